@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+parse throughput of ParseCPP on threads vs worker processes
+
+every input is parsed --copies times at each worker count, once with
+parse_files() (threads of this process, one Index each) and once with a
+process pool that has to pickle code in and records out:
+
+    threads   : ctypes drops the GIL while libclang parses
+    processes : baseline, pays process startup and pickling
+
+usage:
+    python benchmarks/bench_parse_threads.py [-c COPIES] [-w 1,2,4,8] [file.cpp ...]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cpp_fstring.ParseCPP import ParseCPP, parse_files
+
+default_files = sorted(
+    glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "input", "*.cpp"))
+)
+
+
+def parse_counts(job):
+    """
+    records hold libclang cursors, so only counts come back from a worker process
+    """
+    code, filename = job
+    return [len(records) for records in ParseCPP(code, filename, []).extract_interesting_records()]
+
+
+def run_case(name, func, jobs, workers):
+    start = time.perf_counter()
+    func(jobs, workers)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} workers={workers:<3} {elapsed * 1000:8.1f}ms  {len(jobs) / elapsed:8.1f} files/s")
+    return elapsed
+
+
+def with_threads(jobs, workers):
+    parse_files(jobs, [], max_workers=workers)
+
+
+def with_processes(jobs, workers):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(parse_counts, jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", "--copies", type=int, default=4)
+    parser.add_argument("-w", "--workers", default="1,2,4,8")
+    parser.add_argument("filenames", nargs="*", default=default_files)
+    args = parser.parse_args()
+
+    jobs = []
+    for filename in args.filenames:
+        with open(filename, "rb") as f:
+            jobs.append([f.read(), filename])
+    jobs *= args.copies
+
+    # load libclang before timing anything
+    parse_files(jobs[:1], [])
+    print(f"{len(jobs)} parses on {os.cpu_count()} cpus")
+    for name, func in [["threads", with_threads], ["processes", with_processes]]:
+        base = None
+        for workers in [int(w) for w in args.workers.split(",")]:
+            elapsed = run_case(name, func, jobs, workers)
+            base = base or elapsed
+            print(f"{'':<10} speedup={base / elapsed:5.2f}x")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+time to first byte of output for common cpp-fstring invocations
+
+each case runs the cli in a fresh interpreter and measures the time from
+process start until the first byte shows up on stdout:
+
+    --version / --help : should never import clang.cindex
+    cold               : empty output cache, full libclang parse
+    cache hit          : output served from --cache-dir
+
+usage:
+    python benchmarks/bench_startup.py [-n REPEAT] [file.cpp]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+default_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "input", "class_basic.cpp")
+
+
+def time_to_first_byte(cmd, env):
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+    proc.stdout.read(1)
+    first_byte = time.perf_counter() - start
+    proc.stdout.read()
+    proc.wait()
+    return first_byte
+
+
+def run_case(name, cmd, env, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        times.append(time_to_first_byte(cmd, env))
+    print(f"{name:<12} min={min(times) * 1000:8.1f}ms  median={statistics.median(times) * 1000:8.1f}ms")
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument("filename", nargs="?", default=default_file)
+    args = parser.parse_args()
+
+    cli = [sys.executable, "-m", "cpp_fstring.cpp_fstring"]
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, XDG_CACHE_HOME=tmp)
+        cache_dir = os.path.join(tmp, "output-cache")
+
+        def clear_output_cache():
+            shutil.rmtree(os.path.join(cache_dir, "output"), True)
+
+        run_case("--version", cli + ["--version"], env, args.repeat)
+        run_case("--help", cli + ["--help"], env, args.repeat)
+        run_case("cold", cli + ["--cache-dir", cache_dir, args.filename], env, args.repeat, clear_output_cache)
+        run_case("cache hit", cli + ["--cache-dir", cache_dir, args.filename], env, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
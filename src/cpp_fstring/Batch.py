@@ -0,0 +1,207 @@
+"""
+    @file  Batch.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Run cpp-fstring over many files or whole trees: an asyncio pipeline overlaps
+    file reads and writes with parses running in a pool of worker processes.
+
+"""
+import asyncio
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cpp_fstring.cpp_fstring import check_data, check_file, generate_data, write_file, write_outputs
+from cpp_fstring.SymbolTable import symbols
+
+log = logging.getLogger(__name__)
+
+SOURCE_EXTENSIONS = (".c", ".cc", ".cpp", ".cxx", ".c++", ".h", ".hh", ".hpp", ".hxx")
+
+
+class Batch:
+    """
+    expand inputs into [input_file, output_file] jobs and run them in parallel
+
+    in check mode nothing is written and run() returns the stale inputs,
+    otherwise it returns the inputs that failed
+    """
+
+    def __init__(self, args, extraargs, **kwargs):
+        self.args = args
+        self.extraargs = extraargs
+        self.stats = Counter()
+        self.rendered_headers = set()
+
+    def get_output_path(self, relpath):
+        if self.args.output_dir is None:
+            return None
+        return os.path.join(self.args.output_dir, relpath)
+
+    def get_jobs(self, paths):
+        """
+        dirs are walked for source files; outputs keep their path relative to the dir
+        """
+        jobs = []
+        for path in paths:
+            if not os.path.isdir(path):
+                jobs.append([path, self.get_output_path(os.path.basename(path))])
+                continue
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(SOURCE_EXTENSIONS):
+                        filename = os.path.join(root, name)
+                        jobs.append([filename, self.get_output_path(os.path.relpath(filename, path))])
+        return jobs
+
+    def get_affected_jobs(self, jobs):
+        """
+        with --changed, drop jobs whose input neither is nor includes a changed file
+        """
+        if not self.args.changed:
+            return jobs
+        from cpp_fstring.Cache import Cache
+
+        cache = Cache(self.args.cache_dir)
+        changed = {os.path.realpath(path) for path in self.args.changed}
+        affected = [job for job in jobs if cache.is_affected(job[0], changed)]
+        log.info(f"{len(affected)} of {len(jobs)} files affected by {len(changed)} changed files")
+        return affected
+
+    def run(self, paths):
+        jobs = self.get_affected_jobs(self.get_jobs(paths))
+        # symbols and rendered headers are tracked per run
+        symbols.clear()
+        self.rendered_headers.clear()
+        kind = "threads" if self.args.threads else "workers"
+        log.info(f"processing {len(jobs)} files with {self.args.jobs} {kind}")
+
+        if self.args.jobs == 1:
+            worker = check_file if self.args.check else write_file
+            results = [self.run_one(worker, filename, output_path) for filename, output_path in jobs]
+        else:
+            results = asyncio.run(self.run_pipeline(jobs))
+
+        failed = []
+        for [filename, _], (ok, stats) in zip(jobs, results):
+            self.stats.update(stats)
+            if not ok:
+                failed.append(filename)
+        return failed
+
+    def run_one(self, worker, *args):
+        """
+        one bad file shouldn't take down the whole batch
+        """
+        filename = args[0]
+        try:
+            return worker(*args, self.args, self.extraargs)
+        except Exception as e:
+            log.error(f"{filename}: {e}")
+            return False, Counter(failures=1)
+
+    def drop_rendered_headers(self, outputs, stats):
+        """
+        keep only headers no earlier file of the run rendered
+
+        each worker process renders a header once, so with several workers the same
+        header comes back from each of them
+        """
+        output, headers = outputs
+        new_headers = {}
+        for header, header_output in headers.items():
+            path = os.path.realpath(header)
+            if path in self.rendered_headers:
+                stats["headers"] -= 1
+                continue
+            self.rendered_headers.add(path)
+            new_headers[header] = header_output
+        return [output, new_headers]
+
+    def read_job(self, filename, output_path):
+        """
+        load input, and in check mode the current output, into memory
+        """
+        with open(filename, "rb") as f:
+            data = f.read()
+        expect = None
+        if self.args.check and output_path is not None:
+            with open(output_path, "rb") as f:
+                expect = f.read()
+        return data, expect
+
+    async def run_pipeline(self, jobs):
+        """
+        read -> parse -> write with bounded queues
+
+        reads and writes run on threads of the default executor and overlap with
+        parses running in worker processes. Full queues make the stage before them
+        wait, so at most a few inputs and outputs per worker are held in memory.
+        With --threads the parses run on threads instead, each with its own libclang Index.
+        """
+        loop = asyncio.get_running_loop()
+        loaded = asyncio.Queue(maxsize=2 * self.args.jobs)
+        parsed = asyncio.Queue(maxsize=2 * self.args.jobs)
+        results = [None] * len(jobs)
+
+        async def read_all():
+            for index, [filename, output_path] in enumerate(jobs):
+                if self.args.check and output_path is not None and not os.path.isfile(output_path):
+                    results[index] = (False, Counter())
+                    continue
+                try:
+                    data, expect = await loop.run_in_executor(None, self.read_job, filename, output_path)
+                except OSError as e:
+                    log.error(f"{filename}: {e}")
+                    results[index] = (False, Counter(failures=1))
+                    continue
+                await loaded.put((index, filename, data, expect))
+            for _ in range(self.args.jobs):
+                await loaded.put(None)
+
+        async def parse_one(pool):
+            while (item := await loaded.get()) is not None:
+                index, filename, data, expect = item
+                if self.args.check:
+                    call = (self.run_one, check_data, filename, data, expect, jobs[index][1])
+                else:
+                    call = (self.run_one, generate_data, filename, data)
+                await parsed.put((index, await loop.run_in_executor(pool, *call)))
+
+        async def parse_all():
+            executor = ThreadPoolExecutor if self.args.threads else ProcessPoolExecutor
+            with executor(max_workers=self.args.jobs) as pool:
+                await asyncio.gather(*(parse_one(pool) for _ in range(self.args.jobs)))
+            await parsed.put(None)
+
+        async def write_all():
+            while (item := await parsed.get()) is not None:
+                index, (output, stats) = item
+                if self.args.check or output is False:
+                    results[index] = (output, stats)
+                    continue
+                try:
+                    filename, output_path = jobs[index]
+                    output = self.drop_rendered_headers(output, stats)
+                    await loop.run_in_executor(
+                        None, write_outputs, filename, output_path, output, stats, self.args.output_dir
+                    )
+                    results[index] = (True, stats)
+                except OSError as e:
+                    log.error(f"{output_path}: {e}")
+                    results[index] = (False, Counter(failures=1))
+
+        await asyncio.gather(read_all(), parse_all(), write_all())
+        return results
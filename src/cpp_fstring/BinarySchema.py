@@ -0,0 +1,62 @@
+"""
+    @file  BinarySchema.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Schema of the classes and enums that generated encode() members write, so
+    Decoder can turn their bytes back into the text of to_string().
+
+"""
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+
+def record_schema(stats, schema):
+    """
+    add [kind, name, entry] of Processor.schema to stats
+
+    like artifacts of the size report, entries are counter keys, so classes in headers
+    seen by several files are only kept once
+    """
+    for kind, name, entry in schema:
+        stats[("schema", kind, name, json.dumps(entry, sort_keys=True))] += 1
+
+
+class BinarySchema:
+    """
+    classes by type id and enums by name, collected by record_schema
+    """
+
+    def __init__(self, stats, **kwargs):
+        self.classes = {}
+        self.enums = {}
+        for key in sorted(key for key in stats if isinstance(key, tuple) and key[0] == "schema"):
+            _, kind, name, entry = key
+            table = self.classes if kind == "class" else self.enums
+            if name in table:
+                # a type id collision, or a class generated differently by different files
+                log.warning(f"schema has more than one {kind} {name}, keeping {table[name].get('name', name)}")
+                continue
+            table[name] = json.loads(entry)
+
+    def get_record(self):
+        return {"version": SCHEMA_VERSION, "classes": self.classes, "enums": self.enums}
+
+    def write(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.get_record(), f, indent=2)
+            f.write("\n")
+        log.info(f"schema of {len(self.classes)} classes and {len(self.enums)} enums written to {path}")
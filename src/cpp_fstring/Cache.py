@@ -0,0 +1,169 @@
+"""
+    @file  Cache.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    On-disk cache for the resolved libclang library and for processed output.
+
+    Nothing in here imports clang: a cache hit has to be answered without
+    loading libclang at all.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Cache:
+    """
+    store small json records under cache_dir
+
+    .. code-block::
+
+        libclang.json        : {"path": ..., "mtime_ns": ...}
+        output/<key>.json    : {"output": ..., "deps": [[path, mtime_ns, size], ...]}
+        includes/<key>.json  : {"file": ..., "includes": [path, ...]}
+    """
+
+    def __init__(self, cache_dir=None, **kwargs):
+        self.cache_dir = cache_dir or self.get_default_cache_dir()
+
+    @staticmethod
+    def get_default_cache_dir():
+        """
+        follow XDG convention, ie ~/.cache/cpp-fstring
+        """
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(base, "cpp-fstring")
+
+    def read_json(self, path):
+        try:
+            with open(path, encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_json(self, path, data):
+        """
+        write to tmp file and rename so concurrent readers never see partial records
+        """
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.debug(f"unable to write cache file {path}: {e}")
+
+    def get_libclang_path(self):
+        """
+        return previously resolved libclang library if it hasn't changed since
+        """
+        data = self.read_json(os.path.join(self.cache_dir, "libclang.json"))
+        if not data:
+            return None
+        path = data.get("path")
+        try:
+            if os.stat(path).st_mtime_ns != data.get("mtime_ns"):
+                return None
+        except (OSError, TypeError):
+            return None
+        log.debug(f"using cached libclang library : {path}")
+        return path
+
+    def set_libclang_path(self, path):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        self.write_json(os.path.join(self.cache_dir, "libclang.json"), {"path": path, "mtime_ns": mtime_ns})
+
+    def get_key(self, filename, code, extraargs, version="", options=()):
+        """
+        output depends on tool version, where we run from, options, clang args, file name and contents
+        """
+        h = hashlib.sha256()
+        for part in [version, os.getcwd(), *options, filename, *extraargs]:
+            h.update(part.encode("utf8", errors="surrogateescape"))
+            h.update(b"\0")
+        h.update(code)
+        return h.hexdigest()
+
+    def get_output_path(self, key):
+        return os.path.join(self.cache_dir, "output", key[:2], key + ".json")
+
+    def get_dep_stamp(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [path, st.st_mtime_ns, st.st_size]
+
+    def get_output(self, key):
+        """
+        return cached output if none of the files it was generated from have changed
+        """
+        data = self.read_json(self.get_output_path(key))
+        if not data:
+            return None
+        for dep in data.get("deps", []):
+            if self.get_dep_stamp(dep[0]) != dep:
+                log.debug(f"cache entry {key} is stale: {dep[0]} changed")
+                return None
+        return data.get("output", "").encode("utf8", errors="surrogateescape")
+
+    def set_output(self, key, output, deps=()):
+        """
+        output is bytes, stored as text with any invalid utf-8 kept as surrogate escapes
+        """
+        stamps = [self.get_dep_stamp(path) for path in deps]
+        stamps = [stamp for stamp in stamps if stamp is not None]
+        output = output.decode("utf8", errors="surrogateescape")
+        self.write_json(self.get_output_path(key), {"output": output, "deps": stamps})
+
+    def get_includes_path(self, filename):
+        key = hashlib.sha256(os.path.realpath(filename).encode("utf8", errors="surrogateescape")).hexdigest()
+        return os.path.join(self.cache_dir, "includes", key[:2], key + ".json")
+
+    def get_includes(self, filename):
+        """
+        files included by filename when it was last parsed, or None if it never was
+        """
+        data = self.read_json(self.get_includes_path(filename))
+        if not data or data.get("file") != os.path.realpath(filename):
+            return None
+        return data.get("includes", [])
+
+    def set_includes(self, filename, includes):
+        """
+        update the include graph entry of one TU; nothing is written if it didn't change
+        """
+        includes = sorted({os.path.realpath(path) for path in includes})
+        if self.get_includes(filename) == includes:
+            return
+        self.write_json(self.get_includes_path(filename), {"file": os.path.realpath(filename), "includes": includes})
+
+    def is_affected(self, filename, changed):
+        """
+        does a change to any of the changed (real) paths affect the output of filename?
+
+        files missing from the index are always affected
+        """
+        if os.path.realpath(filename) in changed:
+            return True
+        includes = self.get_includes(filename)
+        return includes is None or not changed.isdisjoint(includes)
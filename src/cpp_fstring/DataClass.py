@@ -18,7 +18,7 @@ import types
 from dataclasses import dataclass, field
 from typing import Callable
 
-from clang.cindex import Token
+from clang.cindex import SourceLocation, SourceRange, Token
 
 """
 storage structures for string/enum/class records
@@ -65,9 +65,11 @@ class ClassVar:
     indent: int = 0
     template_type: str = ""  # TODO: use enum for valid values type, non_type, template ?
     is_pointer: bool = False
+    is_range: bool = False
     is_param_pack: bool = False
     parent_node = None
     out: str = ""
+    max_elements: int = None
 
 
 @dataclass
@@ -99,9 +101,48 @@ class ClassRecord:
     needs_to_string: bool = False
     access_specifier: str = "PUBLIC"
     is_anonymous: bool = False
+    namespace: str = None
     bases: list[BaseClassRecord] = field(default_factory=list)
     vars: list[ClassVar] = field(default_factory=list)
     tvars: list[ClassVar] = field(default_factory=list)
+    # base classes printed by their own to_string, as spelled in the class
+    base_types: list[str] = field(default_factory=list)
+
+
+@dataclass
+class StreamRecord:
+    """
+    store string literal that is the right operand of << on an ostream, eg
+
+        std::cout << "x={x}\n" << std::endl;
+
+    spelling and extent run from the stream to the end of the literal, so the
+    insertion can be replaced by fmt::print(std::cout, ...)
+    """
+
+    spelling: str
+    extent: SourceRange
+    location: SourceLocation
+    stream: str
+    literal: str
+    is_chained: bool = False
+
+
+@dataclass
+class LogRecord:
+    """
+    store string literal that is the only argument of a logging macro or function, eg
+
+        LOG_DEBUG("state {big_obj}");
+
+    the format string and args are passed to the call separately, so it only formats
+    them if the level is enabled
+    """
+
+    spelling: str
+    extent: SourceRange
+    location: SourceLocation
+    call: str
 
 
 @dataclass
@@ -0,0 +1,157 @@
+"""
+    @file  Decoder.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Offline decoder of the bytes written by encode() members generated with
+    --binary-schema, producing the same text as to_string() would have.
+
+"""
+import argparse
+import json
+import logging
+import math
+import re
+import struct
+import sys
+
+log = logging.getLogger(__name__)
+
+# codes of fixed size values, see fstr::encode in fstr.h
+FIXED_CODES = "?cbBhHiIqQfdP"
+TYPE_PREFIX_PATTERN = re.compile(r"\b(?:const|volatile|enum|class|struct)\b|&")
+
+
+def format_float(value, size):
+    """
+    shortest text that reads back as the same float or double, like fmt's "{}"
+    """
+    if math.isnan(value) or math.isinf(value):
+        return repr(value)
+    if size == 4:
+        # shortest decimal that rounds to the same float
+        for precision in range(1, 10):
+            text = f"{value:.{precision}g}"
+            if struct.unpack("<f", struct.pack("<f", float(text)))[0] == value:
+                value = float(text)
+                break
+    text = repr(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+class Decoder:
+    """
+    decode records given a schema written by BinarySchema
+
+    .. code-block:: python
+
+        decoder = Decoder(json.load(open("schema.json")))
+        for text in decoder.decode_all(data):
+            print(text)
+    """
+
+    def __init__(self, schema, **kwargs):
+        self.classes = {int(type_id, 16): entry for type_id, entry in schema["classes"].items()}
+        self.enums = schema["enums"]
+        # enums by last part of their name too, when that is unique
+        short_names = {}
+        for name in self.enums:
+            short_names.setdefault(name.rsplit("::", 1)[-1], []).append(name)
+        self.short_enums = {short: names[0] for short, names in short_names.items() if len(names) == 1}
+
+    def get_enum(self, vartype):
+        name = TYPE_PREFIX_PATTERN.sub("", vartype).strip().lstrip(":")
+        if name not in self.enums:
+            name = self.short_enums.get(name.rsplit("::", 1)[-1])
+        return self.enums.get(name)
+
+    def decode(self, data, offset=0):
+        """
+        decode the record at offset: return its text and the offset after it
+        """
+        (type_id,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        entry = self.classes.get(type_id)
+        if entry is None:
+            raise ValueError(f"unknown type id {type_id:08x} at offset {offset - 4}")
+        values = []
+        for field in entry["fields"]:
+            text, offset = self.decode_field(data, offset, field["type"])
+            values.append(text)
+        return self.fill(entry["format"], values), offset
+
+    def decode_all(self, data):
+        """
+        texts of all the records in data, written one after the other
+        """
+        texts = []
+        offset = 0
+        while offset < len(data):
+            text, offset = self.decode(data, offset)
+            texts.append(text)
+        return texts
+
+    def decode_field(self, data, offset, vartype):
+        code = chr(data[offset])
+        offset += 1
+        if code in FIXED_CODES:
+            fmt = "<Q" if code == "P" else f"<{code}"
+            (value,) = struct.unpack_from(fmt, data, offset)
+            offset += struct.calcsize(fmt)
+            if code == "?":
+                return "true" if value else "false", offset
+            if code == "c":
+                return value.decode("latin1"), offset
+            if code in "fd":
+                return format_float(value, struct.calcsize(fmt)), offset
+            if code == "P":
+                return hex(value), offset
+            return str(value), offset
+        if code == "s":
+            (size,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            return data[offset : offset + size].decode("utf8", errors="replace"), offset + size
+        if code == "e":
+            text, offset = self.decode_field(data, offset, "")
+            enum = self.get_enum(vartype)
+            if enum is None:
+                return text, offset
+            return enum["values"].get(text, "<missing>"), offset
+        if code == "r":
+            return self.decode(data, offset)
+        raise ValueError(f"unknown field code {code!r} at offset {offset - 1}")
+
+    def fill(self, format_string, values):
+        """
+        replace the {} of format_string with values in order
+        """
+        values = iter(values)
+        return re.sub(r"\{\{|\}\}|\{\}", lambda match: match[0][0] if match[0] != "{}" else next(values), format_string)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="decode records written by generated encode() members")
+    parser.add_argument("schema", help="schema written by cpp-fstring --binary-schema")
+    parser.add_argument("filenames", nargs="+", help="files of encoded records")
+    args = parser.parse_args()
+
+    with open(args.schema, encoding="utf8") as f:
+        decoder = Decoder(json.load(f))
+    for filename in args.filenames:
+        with open(filename, "rb") as f:
+            for text in decoder.decode_all(f.read()):
+                print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
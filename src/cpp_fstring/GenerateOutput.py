@@ -15,12 +15,15 @@
     Generates output based on change list produced by Processor
 
 """
+import json
 import logging
+import os
 import sys
+from bisect import bisect_right
+from itertools import accumulate, chain
 
 # import bpdb  # noqa: F401
 log = logging.getLogger(__name__)
-sys.stdout.reconfigure(encoding="utf-8")
 
 
 """
@@ -39,23 +42,23 @@ https://clang.llvm.org/doxygen/classclang_1_1tooling_1_1Replacement.html
 
 
 class GenerateOutput:
-    def __init__(self, code, args=None, **kwargs):
+    """
+    apply changes by byte offset and write bytes
+
+    code is bytes-like (bytes or a read-only mmap). Positions come straight from
+    tok.extent offsets, which clang counts in bytes, so nothing is ever decoded.
+    """
+
+    def __init__(self, code, args=None, out=None, **kwargs):
         self.code = code
-        self.offset = 0
+        self.out = out
 
-    def get_absolute_position(self, line_number, column_number):
-        lines = self.code.split("\n")
-        characters_per_line = [len(line) for line in lines]
-        # Add one for the newline character
-        characters_per_line = [1 + i for i in characters_per_line]
-        characters_per_line = [0] + characters_per_line  # Add a zero at the beginning
-        absolute_position = sum(characters_per_line[:line_number]) + column_number - 1
-        return absolute_position
+    def get_out(self):
+        return self.out or sys.stdout.buffer
 
-    def write_changes(self, *args):
+    def get_pos_changes(self, *args):
         """
-        write code changes to stdout
-        changes is a list of [token, replacement_string]
+        flatten lists of [token, replacement_string] into [pos_start, before, after] sorted by position
         """
         changes = []
         for arg in args:
@@ -65,42 +68,197 @@ class GenerateOutput:
         pos_changes = []
         for [tok, replstr] in changes:
             log.debug(f" tok={tok} r={replstr}")
-            pos_start = self.get_absolute_position(tok.extent.start.line, tok.extent.start.column)
-            pos_end = self.get_absolute_position(tok.extent.end.line, tok.extent.end.column)
-            if len(tok.spelling) != pos_end - pos_start:
+            pos_start = tok.extent.start.offset
+            pos_end = tok.extent.end.offset
+            before = bytes(self.code[pos_start:pos_end])
+            if before != tok.spelling.encode("utf8"):
                 log.error(
                     f"""
                 tok : {tok.spelling}
                 extent: {tok.extent}
-                len: {len(tok.spelling)}
+                code: {before}
                 pos: {pos_start} -> {pos_end} = {pos_end - pos_start}
                 """
                 )
-                j = 0
-                for i in range(pos_start, pos_end):
-                    log.error(f" i={i} j={j} tokenstring={tok.spelling[j]} code={self.code[i]}")
-                    j += 1
-            pos_changes.append([pos_start, tok.spelling, replstr])
+            pos_changes.append([pos_start, before, replstr.encode("utf8")])
 
         pos_changes.sort()  # sort by pos_start
-        for [pos_start, before, after] in pos_changes:
-            self.replace_str(pos_start, before, after)
+        return pos_changes
+
+    def get_edits(self, *args):
+        """
+        turn lists of [token, replacement_string] into non-overlapping [start, end, replacement]
+
+        several changes to the same token are chained: the later change replaces the
+        tail of the earlier replacement, which ends with the original token.
+        """
+        edits = []
+        for [pos, before, after] in self.get_pos_changes(*args):
+            if edits and pos < edits[-1][1]:
+                start, end, repl = edits[-1]
+                rel = max(0, pos - end + len(repl))
+                tail = rel + len(before)
+                edits[-1] = [start, end + max(0, tail - len(repl)), repl[:rel] + after + repl[tail:]]
+            else:
+                edits.append([pos, pos + len(before), after])
+        return edits
+
+    def iter_changed_code(self, edits):
+        """
+        yield pieces of code with edits applied, in order.
+        unchanged code is handed out as memoryview slices, ie without copies
+        """
+        view = memoryview(self.code)
+        last = 0
+        for start, end, repl in edits:
+            yield view[last:start]
+            yield repl
+            last = end
+        yield view[last:]
+
+    def write_changes(self, *args):
+        """
+        write code changes to stdout
+        changes is a list of [token, replacement_string]
+        """
+        out = self.get_out()
+        for piece in self.iter_changed_code(self.get_edits(*args)):
+            out.write(piece)
+        out.write(b"\n")
+
+    def matches(self, expect, edits, additions=()):
+        """
+        compare what write_changes() and append() would write against expect,
+        stopping at the first piece that differs
+        """
+        size = len(self.code) + 1
+        size += sum(len(repl) - (end - start) for start, end, repl in edits)
+        size += sum(len(addition.encode("utf8")) + 1 for addition in additions)
+        if size != len(expect):
+            return False
+
+        tail = [b"\n"] + [addition.encode("utf8") + b"\n" for addition in additions]
+        expect = memoryview(expect)
+        pos = 0
+        for piece in chain(self.iter_changed_code(edits), tail):
+            if expect[pos : pos + len(piece)] != piece:
+                return False
+            pos += len(piece)
+        return True
+
+    def get_tail(self, additions):
+        """
+        bytes written after the changed code: the newline and each addition
+        """
+        return b"\n" + b"".join(addition.encode("utf8") + b"\n" for addition in additions)
+
+    def get_all_edits(self, edits, additions=()):
+        """
+        edits plus the additions as one insertion at the end, so applying them gives the full output
+        """
+        return [*edits, [len(self.code), len(self.code), self.get_tail(additions)]]
+
+    def write_edits_json(self, filename, edits, additions=()):
+        """
+        one record per edit: byte offset and length in the input, and the replacement text
+        """
+        records = [
+            {"offset": start, "length": end - start, "replacement": repl.decode("utf8", errors="surrogateescape")}
+            for start, end, repl in self.get_all_edits(edits, additions)
+        ]
+        out = json.dumps({"file": filename, "edits": records}, indent=2, ensure_ascii=False)
+        self.get_out().write(out.encode("utf8", errors="surrogateescape") + b"\n")
 
-        print(self.code)
-        return self.code
+    def write_edits_yaml(self, filename, edits, additions=()):
+        """
+        same records in the format read by clang-apply-replacements.
+        a json string is also a valid yaml double quoted scalar
+        """
+        path = json.dumps(os.path.abspath(filename), ensure_ascii=False)
+        out = f"---\nMainSourceFile:  {path}\nReplacements:\n"
+        for start, end, repl in self.get_all_edits(edits, additions):
+            repl = repl.decode("utf8", errors="surrogateescape")
+            out += f"  - FilePath:        {path}\n"
+            out += f"    Offset:          {start}\n"
+            out += f"    Length:          {end - start}\n"
+            out += f"    ReplacementText: {json.dumps(repl, ensure_ascii=False)}\n"
+        out += "...\n"
+        self.get_out().write(out.encode("utf8", errors="surrogateescape"))
 
-    def replace_str(self, pos, before, after):
+    def split_lines(self, text):
+        pieces = text.split(b"\n")
+        return [piece + b"\n" for piece in pieces[:-1]] + ([pieces[-1]] if pieces[-1] else [])
+
+    def write_diff(self, filename, edits, additions=(), context=3):
         """
-        replace strings in file based on position
+        unified diff built straight from the edits, with no line by line comparison
+
+        the whole file is still split into lines once, to map edit offsets to lines, but
+        only the lines touched by edits and their context make it into hunks
         """
-        pos_start = pos + self.offset
-        pos_end = pos_start + len(before)
-        self.offset += len(after) - len(before)
-        self.code = after.join([self.code[:pos_start], self.code[pos_end:]])
+        code = bytes(self.code)
+        lines = self.split_lines(code)
+        starts = [0] + list(accumulate(len(line) for line in lines))
+
+        def line_of(pos):
+            if pos == len(code) and (not lines or lines[-1].endswith(b"\n")):
+                return len(lines)
+            return min(bisect_right(starts, pos) - 1, len(lines) - 1)
+
+        # blocks of whole lines touched by edits: [first_line, end_line, new_text, end_of_last_edit]
+        blocks = []
+        for start, end, repl in self.get_all_edits(edits, additions):
+            first = line_of(start)
+            last = line_of(end - 1) + 1 if end > start else min(first + 1, len(lines))
+            if blocks and first < blocks[-1][1]:
+                block = blocks[-1]
+                block[2] += code[block[3] : start] + repl
+                block[1], block[3] = max(block[1], last), end
+            else:
+                blocks.append([first, last, code[starts[first] : start] + repl, end])
+        for block in blocks:
+            block[2] += code[block[3] : starts[block[1]]]
+
+        # group blocks into hunks when their context overlaps
+        hunks = []
+        for block in blocks:
+            if hunks and block[0] - context <= hunks[-1][-1][1] + context:
+                hunks[-1].append(block)
+            else:
+                hunks.append([block])
+
+        def emit(prefix, line):
+            if line.endswith(b"\n"):
+                return prefix + line
+            return prefix + line + b"\n\\ No newline at end of file\n"
+
+        name = filename.encode("utf8", errors="surrogateescape")
+        out = [b"--- " + name + b"\n+++ " + name + b"\n"]
+        delta = 0
+        for hunk in hunks:
+            old_start = max(0, hunk[0][0] - context)
+            old_end = min(len(lines), hunk[-1][1] + context)
+            body = []
+            new_count = old_end - old_start
+            pos = old_start
+            for first, last, new_text, _ in hunk:
+                body.extend(emit(b" ", line) for line in lines[pos:first])
+                body.extend(emit(b"-", line) for line in lines[first:last])
+                new_lines = self.split_lines(new_text)
+                body.extend(emit(b"+", line) for line in new_lines)
+                new_count += len(new_lines) - (last - first)
+                pos = last
+            body.extend(emit(b" ", line) for line in lines[pos:old_end])
+            old_count = old_end - old_start
+            new_start = old_start + delta
+            delta += new_count - old_count
+            header = f"@@ -{old_start + (old_count > 0)},{old_count} +{new_start + (new_count > 0)},{new_count} @@\n"
+            out.append(header.encode("utf8"))
+            out.extend(body)
+        self.get_out().write(b"".join(out))
 
     def append(self, addition):
         """
         just append changes to code for now
         """
-        self.code += addition
-        print(addition)
+        self.get_out().write(addition.encode("utf8") + b"\n")
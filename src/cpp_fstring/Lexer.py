@@ -0,0 +1,225 @@
+"""
+    @file  Lexer.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Pure python lexer that finds string literals inside function bodies, for
+    --literals-only runs that don't need libclang at all.
+
+"""
+import logging
+import re
+from dataclasses import dataclass
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class SourceLocation:
+    offset: int
+
+
+@dataclass
+class SourceRange:
+    start: SourceLocation
+    end: SourceLocation
+
+
+@dataclass
+class LiteralToken:
+    """
+    string literal with the parts of the clang Token api that Processor and GenerateOutput use
+    """
+
+    spelling: str
+    extent: SourceRange
+
+
+# kinds of scope opened by {
+BODY = "body"  # function body, or anything nested in one
+INIT = "init"  # brace initializer in a constructor init list
+OTHER = "other"  # namespace, class, extern "C", aggregate initializer...
+
+
+class Lexer:
+    """
+    scan bytes for string literals in function bodies, ie the same literals
+    ParseCPP.extract_string_records finds in COMPOUND_STMT nodes
+
+    the scan only stops at comments, directives, literals, numbers with digit
+    separators and { } ;. When a { opens at namespace or class scope, the text
+    since the previous ; { or } decides if it starts a function body:
+
+    .. code-block:: CPP
+
+        void f(int a) const {          // body: ) followed only by qualifiers
+        auto g = [](int a) {           // body: lambda
+        X::X() : a_(1), b_{2} {        // init brace, then body
+        struct S : B<decltype(f())> {  // class
+        int a[] = {                    // aggregate
+
+    Without a preprocessor, both branches of an #if are seen, so branches that
+    open braces differently can confuse the scope tracking.
+    """
+
+    # only try at quotes, comments, directives, braces, semicolons, literal prefixes and numbers.
+    # raw strings are only matched up to the opening paren, the rest is found with bytes.find
+    tokens = rb"""
+          (?P<comment>    //[^\n\\]*(?:\\(?:\r\n|.)[^\n\\]*)* | /\*.*?(?:\*/|\Z) )
+        | (?P<directive>  \#[^\n\\]*(?:\\(?:\r\n|.)[^\n\\]*)* )
+        | (?P<raw>        \b(?:u8|[uUL])?R"(?P<delim>[^()\\\s"]{0,16})\( )
+        | (?P<string>     (?:\b(?:u8|[uUL]))?"[^"\\\n]*(?:\\(?:\r\n|.)[^"\\\n]*)*"\w* )
+        | (?P<char>       (?:\b(?:u8|[uUL]))?'[^'\\\n]*(?:\\(?:\r\n|.)[^'\\\n]*)*'\w* )
+        | (?P<number>     (?<![\w.])\.?[0-9](?:[eEpP][+-]|[\w.])*'(?:[eEpP][+-]|'(?=\w)|[\w.])* )
+        | (?P<open>       \{ )
+        | (?P<close>      \} )
+        """
+    pattern = re.compile(
+        rb"""(?=[/"'{};\#]|\b[uULR0-9]|\.[0-9])(?:""" + tokens + rb"| (?P<semi> ; ))", re.VERBOSE | re.DOTALL
+    )
+    # inside function bodies ; doesn't matter
+    body_pattern = re.compile(rb"""(?=[/"'{}\#]|\b[uULR0-9]|\.[0-9])(?:""" + tokens + rb")", re.VERBOSE | re.DOTALL)
+    paren_pattern = re.compile(rb"[():]")
+
+    # parts of a declaration head that don't matter for deciding its kind
+    noise_pattern = re.compile(
+        rb"""
+          //[^\n\\]*(?:\\(?:\r\n|.)[^\n\\]*)* | /\*.*?(?:\*/|\Z)
+        | \#[^\n\\]*(?:\\(?:\r\n|.)[^\n\\]*)*
+        | (?:\b(?:u8|[uUL]))?R"([^()\\\s"]{0,16})\(.*?\)\1"
+        | (?:\b(?:u8|[uUL]))?"[^"\\\n]*(?:\\(?:\r\n|.)[^"\\\n]*)*"
+        | (?:\b(?:u8|[uUL]))?'[^'\\\n]*(?:\\(?:\r\n|.)[^'\\\n]*)*'
+        | \[\[.*?\]\]
+        | \b(?:alignas|__attribute__|__declspec)\s*\((?:[^()]|\([^()]*\))*\)
+        | \\\r?\n
+        """,
+        re.VERBOSE | re.DOTALL,
+    )
+    noise_hint_pattern = re.compile(rb"""[/#"'\[\\]|__attribute__|__declspec|alignas""")
+    label_pattern = re.compile(rb"\s*(?:public|protected|private)\s*:(?!:)")
+    class_pattern = re.compile(rb"\s*(?:(?:typedef|friend|static|inline)\s+)*(?:class|struct|union|enum)\b")
+    qualifier_pattern = re.compile(
+        rb"""\s*(?:(?:const|volatile|noexcept|override|final|mutable|constexpr|consteval|try|&&?)(?!\w)\s*)*
+        (?:->[^;{}=]*|requires\b[^;{}]*)?$""",
+        re.VERBOSE,
+    )
+    suffix_pattern = re.compile(rb"\w*")
+    lambda_pattern = re.compile(rb"(?:[=(,]|\breturn)\s*\[[^\[\]]*\]\s*(?:(?:mutable|constexpr)\s*)*$")
+
+    def skip_template_prefix(self, head):
+        """
+        drop template <...> from the start of head
+        """
+        match = re.match(rb"\s*template\s*<", head)
+        if match is None:
+            return head
+        depth = 1
+        for pos in range(match.end(), len(head)):
+            char = head[pos : pos + 1]
+            if char == b"<":
+                depth += 1
+            elif char == b">":
+                depth -= 1
+                if depth == 0:
+                    return self.skip_template_prefix(head[pos + 1 :])
+        return head
+
+    def get_scope(self, head):
+        """
+        kind of scope opened by a { at namespace or class scope, given the text since the last ; { or }
+        """
+        if b"(" not in head and b"[" not in head:
+            return OTHER
+        if self.noise_hint_pattern.search(head):
+            head = self.noise_pattern.sub(b" ", head)
+        if b":" in head:
+            head = self.label_pattern.sub(b"", head, count=1)
+        head = self.skip_template_prefix(head)
+
+        # positions of ) and single : at paren depth 0
+        depth = 0
+        last_paren = -1
+        colon_after_paren = False
+        for match in self.paren_pattern.finditer(head):
+            char = match[0]
+            if char == b"(":
+                depth += 1
+            elif char == b")":
+                depth -= 1
+                if depth == 0:
+                    last_paren = match.start()
+            elif depth == 0 and last_paren >= 0:
+                pos = match.start()
+                is_scope = head[pos + 1 : pos + 2] == b":" or head[pos - 1 : pos] == b":"
+                colon_after_paren = colon_after_paren or not is_scope
+
+        is_class = self.class_pattern.match(head) is not None
+        if colon_after_paren and not is_class:
+            # constructor init list: members are initialized with name(..) or name{..}
+            tail = head.rstrip()
+            return BODY if tail.endswith((b")", b"}")) else INIT
+        if self.lambda_pattern.search(head):
+            return BODY
+        if last_paren < 0:
+            return OTHER
+        if is_class and head.find(b":") < head.find(b"("):
+            return OTHER
+        if self.qualifier_pattern.match(head, last_paren + 1):
+            return BODY
+        return OTHER
+
+    def extract_string_records(self, data):
+        """
+        return LiteralTokens of string (and like clang, char) literals in function bodies that contain { or }
+        """
+        records = []
+        scopes = []
+        head_start = 0
+        pos = 0
+        while True:
+            in_body = bool(scopes) and scopes[-1] == BODY
+            match = (self.body_pattern if in_body else self.pattern).search(data, pos)
+            if match is None:
+                return records
+            kind = match.lastgroup
+            start, pos = match.span()
+            if kind == "string" or kind == "raw" or kind == "char":
+                if kind == "raw":
+                    end_marker = b")" + match["delim"] + b'"'
+                    end = data.find(end_marker, pos)
+                    pos = len(data) if end < 0 else self.suffix_pattern.match(data, end + len(end_marker)).end()
+                if in_body:
+                    spelling = bytes(data[start:pos])
+                    # same test as ParseCPP: skip the quote and any prefix
+                    if spelling.find(b"{") > 0 or spelling.find(b"}") > 0:
+                        records.append(
+                            LiteralToken(
+                                spelling.decode("utf8"), SourceRange(SourceLocation(start), SourceLocation(pos))
+                            )
+                        )
+            elif kind == "open":
+                if in_body or (scopes and scopes[-1] == INIT):
+                    scopes.append(scopes[-1])
+                else:
+                    scopes.append(self.get_scope(bytes(data[head_start:start])))
+                if scopes[-1] != INIT:
+                    head_start = pos
+            elif kind == "close":
+                scope = scopes.pop() if scopes else OTHER
+                if scope != INIT:
+                    head_start = pos
+            elif kind == "semi" and not in_body:
+                head_start = pos
+            elif kind == "comment" or kind == "directive":
+                # keep comments and directives before a declaration out of its head
+                if not in_body and (start == head_start or data[head_start:start].isspace()):
+                    head_start = pos
@@ -0,0 +1,125 @@
+"""
+    @file  Metrics.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Run metrics as a prometheus textfile or as json lines.
+
+"""
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+# upper bounds of latency histogram buckets in seconds
+BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0]
+PHASES = ["parse", "extract", "generate"]
+# stats counters exported as is
+COUNTERS = [
+    ["files", "files processed"],
+    ["bytes_in", "bytes read from input files"],
+    ["bytes_out", "bytes of output produced"],
+    ["cache_hits", "files answered from the output cache"],
+    ["parse_skipped", "files skipped by the prescan"],
+    ["unchanged", "outputs that didn't need a write"],
+    ["failures", "files that raised an error"],
+    ["over_budget", "files over their time or memory budget"],
+    ["duplicates_avoided", "class/enum definitions of edited headers skipped, since an earlier file generated them"],
+]
+
+
+def observe(stats, phase, seconds):
+    """
+    add one latency sample to stats
+
+    histograms are kept as plain counters in stats, so stats of different files and
+    workers still just add up
+    """
+    for le in BUCKETS:
+        if seconds <= le:
+            stats[("seconds_bucket", phase, le)] += 1
+    stats[("seconds_sum", phase)] += seconds
+    stats[("seconds_count", phase)] += 1
+
+
+class Metrics:
+    """
+    metrics of one run, from the merged stats of all its files
+    """
+
+    def __init__(self, stats, duration, **kwargs):
+        self.stats = stats
+        self.duration = duration
+        self.timestamp = time.time()
+
+    def get_cache_hit_ratio(self):
+        return self.stats["cache_hits"] / self.stats["files"] if self.stats["files"] else 0.0
+
+    def get_histogram(self, phase):
+        return {
+            "buckets": {str(le): self.stats[("seconds_bucket", phase, le)] for le in BUCKETS},
+            "sum": self.stats[("seconds_sum", phase)],
+            "count": self.stats[("seconds_count", phase)],
+        }
+
+    def get_record(self):
+        record = {"timestamp": self.timestamp, "duration_seconds": self.duration}
+        record.update({name: self.stats[name] for name, _ in COUNTERS})
+        record["cache_hit_ratio"] = self.get_cache_hit_ratio()
+        record["latency_seconds"] = {phase: self.get_histogram(phase) for phase in PHASES}
+        return record
+
+    def get_prometheus_text(self):
+        """
+        values describe the last run, so everything but the histograms is a gauge
+        """
+        lines = []
+
+        def add_gauge(name, text, value):
+            lines.append(f"# HELP cpp_fstring_{name} {text}")
+            lines.append(f"# TYPE cpp_fstring_{name} gauge")
+            lines.append(f"cpp_fstring_{name} {value}")
+
+        add_gauge("last_run_timestamp_seconds", "end of the last run", self.timestamp)
+        add_gauge("last_run_duration_seconds", "wall time of the last run", self.duration)
+        for name, text in COUNTERS:
+            add_gauge(f"last_run_{name}", f"{text} in the last run", self.stats[name])
+        add_gauge(
+            "last_run_cache_hit_ratio", "share of files answered from the output cache", self.get_cache_hit_ratio()
+        )
+
+        name = "cpp_fstring_last_run_phase_seconds"
+        lines.append(f"# HELP {name} time per file spent in each phase in the last run")
+        lines.append(f"# TYPE {name} histogram")
+        for phase in PHASES:
+            histogram = self.get_histogram(phase)
+            for le, count in histogram["buckets"].items():
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{le}"}} {count}')
+            lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {histogram["sum"]}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        replace the textfile in one rename, so a collector never reads half of it
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            f.write(self.get_prometheus_text())
+        os.replace(tmp_path, path)
+
+    def append_json(self, path):
+        with open(path, "a", encoding="utf8") as f:
+            f.write(json.dumps(self.get_record()) + "\n")
@@ -24,17 +24,34 @@ token:
     keyword, identifier, literal, operator or punctuation symbol
 """
 
+import fnmatch
+import glob
 import logging
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Callable
 
 from clang.cindex import AccessSpecifier, Config, Cursor
 from clang.cindex import CursorKind as CK
-from clang.cindex import Index, Token, TokenKind, TranslationUnit, TypeKind
+from clang.cindex import Index, SourceRange, Token, TokenKind, TranslationUnit, TypeKind, conf
 
 # import bpdb  # noqa: F401
-from cpp_fstring.DataClass import BaseClassRecord, ClassRecord, ClassVar, EnumConstantDecl, EnumRecord, dump
+from cpp_fstring.Cache import Cache
+from cpp_fstring.DataClass import (
+    BaseClassRecord,
+    ClassRecord,
+    ClassVar,
+    EnumConstantDecl,
+    EnumRecord,
+    LogRecord,
+    StreamRecord,
+    dump,
+)
+from cpp_fstring.SymbolTable import symbols as process_symbols
 
 # from cpp_fstring.clang.cindex import AccessSpecifier, Config, Cursor
 # from cpp_fstring.clang.cindex import CursorKind as CK
@@ -42,26 +59,68 @@ from cpp_fstring.DataClass import BaseClassRecord, ClassRecord, ClassVar, EnumCo
 
 log = logging.getLogger(__name__)
 
+# libclang is loaded once per process, each thread then parses with its own Index
+_libclang_lock = threading.Lock()
+_thread_state = threading.local()
+
+# streams that are known by name when std headers aren't parsed and their type is unknown
+STANDARD_STREAMS = ["std::cout", "std::cerr", "std::clog", "cout", "cerr", "clog"]
+# char streams that fmt::print can write to, by canonical type
+OSTREAM_PATTERN = re.compile(r"\bbasic_(?:i?o|o?f|o?string|osync)stream<char\b")
+# fields that are ranges, and get bounded with --max-elements: arrays by type kind,
+# std containers by name, as their type is unknown when std headers aren't parsed
+ARRAY_TYPE_KINDS = [
+    TypeKind.CONSTANTARRAY,
+    TypeKind.INCOMPLETEARRAY,
+    TypeKind.VARIABLEARRAY,
+    TypeKind.DEPENDENTSIZEDARRAY,
+]
+CONTAINER_PATTERN = re.compile(
+    r"\b(?:array|vector|deque|(?:forward_)?list|(?:unordered_)?(?:multi)?(?:set|map)|span|valarray)\s*<"
+)
+
 
 class ParseCPP:
     """
     parse cpp file
     """
 
-    def __init__(self, code, filename, extraargs, **kwargs):
+    def __init__(
+        self,
+        code,
+        filename,
+        extraargs,
+        cache=None,
+        symbols=None,
+        edit_headers=None,
+        print_to_stream=False,
+        log_calls=None,
+        delegate_bases=False,
+        **kwargs,
+    ):
         self.string_records = []
         self.enum_records = []
         self.class_records = []
 
-        # used by callback
-        self.enum_record = None
-        self.class_record = None
-        self.cxx_base_specifier = set()
-
         self.code = code
         self.filename = filename
         self.file = None
         self.extraargs = extraargs
+        self.cache = cache if cache is not None else Cache()
+        self.symbols = symbols if symbols is not None else process_symbols
+        self.duplicates = 0
+        # glob patterns of included headers that get edits too
+        self.edit_headers = edit_headers or []
+        # record literals streamed into an ostream as StreamRecords
+        self.print_to_stream = print_to_stream
+        # names of logging macros and functions that take a format string and args
+        self.log_calls = log_calls or []
+        # print base classes with their own to_string instead of copying their fields
+        self.delegate_bases = delegate_bases
+        self.dependencies = []
+        # seconds spent in index.parse and in walking the TU afterwards
+        self.parse_seconds = 0.0
+        self.extract_seconds = 0.0
         self.interesting_kinds = [
             CK.COMPOUND_STMT,  # for strings
             CK.ENUM_DECL,  # for enum
@@ -96,12 +155,12 @@ class ParseCPP:
         # syspath = ccsyspath.system_include_paths('clang++')
         # incargs = [b'-I' + inc for inc in syspath]
 
-        unsaved_files = [(self.filename, self.code)]
+        # cindex wants bytes for the contents, clang offsets then count bytes of this buffer
+        unsaved_files = [(self.filename, bytes(self.code))]
 
-        if not Config.loaded:
-            self.set_libclang_from_lib()
-        index = Index.create()
+        index = self.get_index()
         log.debug(f"clang args = {args}")
+        start = time.perf_counter()
         tu = index.parse(path=None, args=args, unsaved_files=unsaved_files, options=TranslationUnit.PARSE_INCOMPLETE)
         if not tu:
             log.error(f"unable to load input using args = {args}")
@@ -109,6 +168,8 @@ class ParseCPP:
             log.debug(diagnostic.format())
 
         self.file = tu.get_file(self.filename)  # to compare against external included files
+        self.dependencies = [inc.include.name for inc in tu.get_includes()]
+        self.parse_seconds = time.perf_counter() - start
 
         # self.find_string_records(tu.cursor)
         # self.get_info(tu.cursor)
@@ -118,19 +179,61 @@ class ParseCPP:
         self.find_existing_formatters()
         self.extract_enum_records()
         self.extract_class_records()
+        self.extract_seconds = time.perf_counter() - start - self.parse_seconds
 
         return self.string_records, self.enum_records, self.class_records
 
+    def get_index(self):
+        """
+        cindex Index of the calling thread, created on first use
+        """
+        index = getattr(_thread_state, "index", None)
+        if index is None:
+            self.load_libclang()
+            index = _thread_state.index = Index.create()
+        return index
+
+    def load_libclang(self):
+        """
+        Config is global to the process, so only the first thread to get here sets it up
+        """
+        if Config.loaded:
+            return
+        with _libclang_lock:
+            if Config.loaded:
+                return
+            self.find_libclang_lib()
+            # force the ctypes load while holding the lock
+            conf.lib
+
     def find_libclang_lib(self):
-        file_name, dirs = self.get_libclang_file_dirs()
-        file = self.find_first_file(file_name, dirs)
+        """
+        use the library found by a previous run if it is still there, else search for it
+        """
+        file = self.cache.get_libclang_path()
         if file is None:
-            log.error(f"can't find pre-built lib {file_name} under dirs {dirs}")
-            exit()
+            file_name, dirs = self.get_libclang_file_dirs()
+            file = self.find_first_file(file_name, dirs)
+            if file is None:
+                log.error(f"can't find pre-built lib {file_name} under dirs {dirs}")
+                exit()
+            self.cache.set_libclang_path(file)
         log.info(f"using library file {file}")
         if not Config.loaded:
             Config.set_library_file(file)
 
+    def get_libclang_file_dirs(self):
+        """
+        assume libclang.dylib/dll/so is under "native" dir of clang lib,
+        then fall back to usual system locations
+        """
+        import clang  # noqa: E402
+
+        dirs = [os.path.join(os.path.realpath(clang.__path__[0]), "native")]
+        dirs.extend(sorted(glob.glob("/usr/lib/llvm-*/lib"), reverse=True))
+        dirs.extend(["/usr/lib", "/usr/local/lib", "/opt/homebrew/opt/llvm/lib", "/usr/local/opt/llvm/lib"])
+        return self.get_libclang_file(), [dir for dir in dirs if os.path.isdir(dir)]
+
     def set_filename_for_parsing(self):
         """
         deal with include files
@@ -162,7 +265,13 @@ class ParseCPP:
     def find_first_file(self, file_name, dirs):
         """
         find first file matching file_name in list of dirs
+
+        the top of each dir is checked before walking any of them
         """
+        for dir_path in dirs:
+            file_path = os.path.join(dir_path, file_name)
+            if os.path.isfile(file_path):
+                return file_path
         for dir_path in dirs:
             for root, dirs, files in os.walk(dir_path):
                 if file_name in files:
@@ -186,21 +295,6 @@ class ParseCPP:
                         newest_time = file_time
         return newest_file
 
-    def set_libclang_from_lib(self):
-        """
-        assume libclang.dylib/dll/so is under "native" dir of clang lib
-        """
-        import clang  # noqa: E402
-
-        dir = clang.__path__[0]
-        library_path = os.path.join(os.path.realpath(dir), "native")
-        file = os.path.join(library_path, self.get_libclang_file())
-        if os.path.isfile(file):
-            log.debug(f"using libclang library : {file}")
-        else:
-            log.error(f"libclang file not found: {file}")
-        Config.set_library_file(file)
-
     def dup_nodes_remover(self, nodes):
         seen = set()
         res = []
@@ -299,6 +393,35 @@ class ParseCPP:
 
             log.debug(line)
 
+    def is_defined_here(self, node, last_tok):
+        """
+        does this TU generate code for node?
+
+        always for the main file and never for other headers. A class or enum of an
+        allow-listed header is only extracted by the first TU of the run that sees it,
+        which renders the header; later TUs skip its var and template walk.
+        """
+        file = last_tok.location.file.name
+        if file == self.filename:
+            return True
+        if not self.is_editable(file):
+            return False
+        if self.symbols.add(node.get_usr(), node.spelling, node.kind.name, file):
+            return True
+        self.duplicates += 1
+        return False
+
+    def is_editable(self, file):
+        """
+        edits go to the main file and to included headers matching --edit-headers
+        """
+        if file == self.filename:
+            return True
+        return any(
+            fnmatch.fnmatch(file, pattern) or fnmatch.fnmatch(os.path.realpath(file), pattern)
+            for pattern in self.edit_headers
+        )
+
     def extract_enum_records(self):
         """
         look at nodes for enum decl and definitions
@@ -321,8 +444,7 @@ class ParseCPP:
                 continue
 
             # skip this enum because it is external--only internal enums are supported
-            is_external = last_tok.location.file.name != self.filename
-            if is_external:
+            if not self.is_defined_here(node, last_tok):
                 continue
 
             # TODO: find a more robust solution for anon namespace
@@ -333,6 +455,7 @@ class ParseCPP:
                 enum_record = EnumRecord(name)
                 enum_record.is_anonymous = node.is_anonymous()
 
+            enum_record.last_tok = last_tok
             enum_record.is_scoped = node.is_scoped_enum()
             kind = node.type.get_declaration().kind
             # CK.NO_DECL_FOUND when struct S { using enum Fruit; };
@@ -357,33 +480,135 @@ class ParseCPP:
 
             enum_record.is_in_function = self.get_enclosing_function(node)
 
-            self.enum_record = enum_record
-            self.visit(node, 0, set(), self.cb_extract_enum_records)
-            self.enum_records.append(self.enum_record)
+            self.visit(node, 0, set(), partial(self.cb_extract_enum_records, enum_record))
+            self.enum_records.append(enum_record)
 
-    def cb_extract_enum_records(self, node, indent):
+    def cb_extract_enum_records(self, enum_record, node, indent):
         """
         for each visited note, look for constant declarations
         """
         if node.kind == CK.ENUM_CONSTANT_DECL:
             enum_constant_decl = EnumConstantDecl(node.displayname, str(node.enum_value))
-            self.enum_record.values.append(enum_constant_decl)
+            enum_record.values.append(enum_constant_decl)
 
     def extract_string_records(self):
         """
         just create a list of string object tokens
+
+        tokens of nested blocks show up once per enclosing block, keep only the first
         """
+        seen = set()
         for node in self.nodelist[CK.COMPOUND_STMT]:
             # skip if external
-            is_external = node.location.file.name != self.filename
-            if is_external:
+            if not self.is_editable(node.location.file.name):
                 continue
-            for token in node.get_tokens():
+            tokens = list(node.get_tokens())
+            for index, token in enumerate(tokens):
                 if token.kind == TokenKind.LITERAL:
                     in_str = token.spelling
                     log.debug(f"{token.cursor.kind.name}  str: {token.spelling}")
                     if in_str.find("{") > 0 or in_str.find("}") > 0:
-                        self.string_records.append(token)
+                        offset = token.extent.start.offset
+                        if offset not in seen:
+                            seen.add(offset)
+                            record = self.get_stream_record(tokens, index) if self.print_to_stream else None
+                            if record is None and self.log_calls:
+                                record = self.get_log_record(tokens, index)
+                            self.string_records.append(record or token)
+
+    def get_stream_record(self, tokens, index):
+        """
+        StreamRecord if tokens[index] is a char literal streamed into an ostream as the
+        start of a statement, ie a plain name followed by << and the literal:
+
+            std::cout << "{x}";        ->  fmt::print(std::cout, "{}", x);
+            os << "{x}" << y;          ->  fmt::print(os, "{}", x), os << y;
+
+        the stream has to be an ostream, or if its type is unknown because std headers
+        weren't parsed, one of STANDARD_STREAMS. Anything else stays a plain literal.
+        """
+        token = tokens[index]
+        if not token.spelling.startswith(('"', 'R"')) or index < 2 or tokens[index - 1].spelling != "<<":
+            return None
+        next_spelling = tokens[index + 1].spelling if index + 1 < len(tokens) else None
+        if next_spelling not in (";", "<<"):
+            return None
+
+        # walk back over the name of the stream, eg std::cout or this->os
+        start = index - 1
+        while start > 0 and (
+            tokens[start - 1].kind == TokenKind.IDENTIFIER or tokens[start - 1].spelling in ("::", ".", "->", "this")
+        ):
+            start -= 1
+        if start == index - 1 or tokens[start].spelling in ("::", ".", "->"):
+            return None
+        if start == 0 or not self.is_statement_start(tokens, start - 1):
+            return None
+
+        stream = "".join(tok.spelling for tok in tokens[start : index - 1])
+        stream_type = tokens[index - 2].cursor.type
+        if stream_type.kind == TypeKind.INVALID:
+            if stream not in STANDARD_STREAMS:
+                return None
+        elif not OSTREAM_PATTERN.search(stream_type.get_canonical().spelling):
+            return None
+
+        first = tokens[start]
+        begin, end = first.extent.start.offset, token.extent.end.offset
+        return StreamRecord(
+            spelling=bytes(self.code[begin:end]).decode("utf8"),
+            extent=SourceRange.from_locations(first.extent.start, token.extent.end),
+            location=first.location,
+            stream=stream,
+            literal=token.spelling,
+            is_chained=next_spelling == "<<",
+        )
+
+    def get_log_record(self, tokens, index):
+        """
+        LogRecord if tokens[index] is the only argument of a call to one of log_calls, eg
+
+            LOG_DEBUG("state {big_obj}");  ->  LOG_DEBUG("state {}", big_obj);
+
+        calls match by the name as written, eg spdlog::debug, or by its last part
+        """
+        token = tokens[index]
+        if index < 2 or tokens[index - 1].spelling != "(":
+            return None
+        if index + 1 >= len(tokens) or tokens[index + 1].spelling != ")":
+            return None
+
+        start = index - 1
+        while start > 0 and (
+            tokens[start - 1].kind == TokenKind.IDENTIFIER or tokens[start - 1].spelling in ("::", ".", "->")
+        ):
+            start -= 1
+        if start == index - 1:
+            return None
+        call = "".join(tok.spelling for tok in tokens[start : index - 1])
+        if call not in self.log_calls and tokens[index - 2].spelling not in self.log_calls:
+            return None
+
+        return LogRecord(spelling=token.spelling, extent=token.extent, location=token.location, call=call)
+
+    def is_statement_start(self, tokens, index):
+        """
+        does a statement start after tokens[index]? ) counts if it closes the condition of if, while or for
+        """
+        spelling = tokens[index].spelling
+        if spelling in (";", "{", "}", "else", "do"):
+            return True
+        if spelling != ")":
+            return False
+        depth = 0
+        for pos in range(index, -1, -1):
+            if tokens[pos].spelling == ")":
+                depth += 1
+            elif tokens[pos].spelling == "(":
+                depth -= 1
+                if depth == 0:
+                    return pos > 0 and tokens[pos - 1].spelling in ("if", "while", "for")
+        return False
 
     def get_qualified_name(self, node):
         if node is None:
@@ -429,7 +654,7 @@ class ParseCPP:
         is_in_function = kind == CK.CXX_METHOD
         return is_in_function
 
-    def extract_vars_from_class(self, node, prefix, indent):
+    def extract_vars_from_class(self, node, prefix, indent, base_types=None):
         """
         associate vars with nested classes
 
@@ -438,10 +663,17 @@ class ParseCPP:
         - add immediate variables
             - for templates need to calculate specialization name
         - then add variables from base classes
+
+        if base_types is a list, direct bases that can print themselves are added to it
+        instead of having their variables copied
         """
         var_records = []
         if node is None:
             return var_records
+        direct_bases = [fd for fd in node.get_children() if fd.kind == CK.CXX_BASE_SPECIFIER]
+        # [spelling, base specifier] of each base in the class head, base specifier is None
+        # when the base is missing from the parse
+        spelled_bases = self.match_spelled_bases(node, direct_bases) if indent == 0 else []
 
         # if "Map" in node.spelling:
         #    for fd in node.get_children():
@@ -462,6 +694,7 @@ class ParseCPP:
                 )
                 var_record.is_anonymous = fd.is_anonymous()
                 var_record.is_pointer = fd.type.kind == TypeKind.POINTER
+                var_record.is_range = self.is_range(fd)
                 var_record.parent_node = node
                 var_records.append(var_record)
 
@@ -480,17 +713,182 @@ class ParseCPP:
 
                 # gather more variables from base classes
                 base_node = fd.get_definition()
+                if base_types is not None and fd in direct_bases and self.can_delegate(self.get_base_class(fd)):
+                    base_types.append(fd.type.spelling)
+                    continue
+                if indent == 0 and fd in direct_bases and self.is_empty_specialization(fd, base_node):
+                    self.report_left_out_base(node, fd.type.spelling, is_specialization=True)
                 derived_var_records = self.extract_vars_from_class(base_node, prefix, indent + 1)
                 for rec in derived_var_records:
                     if fd.access_specifier != AccessSpecifier.PUBLIC:
                         rec.access_specifier = fd.access_specifier.name
                     var_records.append(rec)
 
+        if any(fd is None for _, fd in spelled_bases):
+            self.add_missing_bases(node, spelled_bases, base_types)
+
         # for fd in node.walk_preorder():
         #    print(f" {fd.spelling} {fd.type.spelling} {fd.kind} ")
         #    dump(fd, fd.spelling)
         return var_records
 
+    def match_spelled_bases(self, node, direct_bases):
+        """
+        bases as spelled in the class head of node, each with its base specifier or None
+
+        a base that names a type clang doesn't know, eg Holder<std::string> when std
+        headers aren't found, has no base specifier at all
+        """
+        spelled_bases = []
+        depth = 0
+        tokens = None
+        for tok in node.get_tokens():
+            text = tok.spelling
+            if depth == 0 and text == "{":
+                break
+            if depth == 0 and text == ":" and tokens is None:
+                tokens = []
+                continue
+            if depth == 0 and text == "," and tokens is not None:
+                spelled_bases.append(tokens)
+                tokens = []
+                continue
+            depth += {"<": 1, "(": 1, "[": 1, ">": -1, ")": -1, "]": -1, ">>": -2}.get(text, 0)
+            if tokens is not None:
+                tokens.append(text)
+        if tokens:
+            spelled_bases.append(tokens)
+
+        unmatched = list(direct_bases)
+        pairs = []
+        for tokens in spelled_bases:
+            while tokens and tokens[0] in ("public", "protected", "private", "virtual"):
+                tokens = tokens[1:]
+            spelling = re.sub(r"(?<=\w) (?=\w)|(?<!\w) | (?!\w)", "", " ".join(tokens))
+            name = spelling.split("<")[0].split("::")[-1]
+            fd = next((fd for fd in unmatched if fd.type.spelling.split("<")[0].split("::")[-1] == name), None)
+            if fd is not None:
+                unmatched.remove(fd)
+            pairs.append([spelling, fd])
+        return pairs
+
+    def add_missing_bases(self, node, spelled_bases, base_types):
+        """
+        delegate to bases missing from the parse that are specializations of a class
+        template that can print itself, else report that they are left out
+
+        clang drops a base specifier when the base names a type it doesn't know, or
+        when a fatal error, like a missing std header, stops it instantiating templates
+        """
+        recovered = []
+        for spelling, fd in spelled_bases:
+            if fd is not None:
+                continue
+            name = spelling.split("<")[0].split("::")[-1]
+            templates = [tn for tn in self.nodelist[CK.CLASS_TEMPLATE] if tn.spelling == name]
+            is_specialization = "<" in spelling and len(templates) > 0
+            if base_types is not None and is_specialization and any(self.can_delegate(tn) for tn in templates):
+                recovered.append(spelling)
+                continue
+            self.report_left_out_base(node, spelling, is_specialization)
+        if recovered:
+            # bases print in the order of the class head
+            delegated = set(base_types + recovered)
+            order = [spelling if fd is None else fd.type.spelling for spelling, fd in spelled_bases]
+            base_types[:] = [base for base in order if base in delegated]
+
+    def report_left_out_base(self, node, spelling, is_specialization):
+        """
+        log a base of node that neither gets its fields copied nor prints itself
+
+        fields of template specializations were never copied, so that is only info, and
+        std bases are expected to be unknown as std headers aren't parsed
+        """
+        if is_specialization:
+            log.info(
+                f"base {spelling} of {node.spelling} is a template specialization without fields in the parse, "
+                "and is left out of its to_string(), unless it is printed with --inherited-fields delegate"
+            )
+        elif spelling.startswith("std::"):
+            log.debug(f"std base {spelling} of {node.spelling} is left out of its to_string()")
+        else:
+            log.warning(
+                f"base {spelling} of {node.spelling} isn't declared in the parse, probably for a missing include, "
+                "and is left out of its to_string()"
+            )
+
+    def is_empty_specialization(self, fd, base_node):
+        """
+        is base specifier fd a template specialization, like Base<int>, that has no members
+        in the parse while its template does?
+        """
+        template = self.get_base_class(fd)
+        if template is None or template.kind != CK.CLASS_TEMPLATE:
+            return False
+        if base_node is not None and any(True for _ in base_node.get_children()):
+            return False
+        return self.has_fields(template)
+
+    def get_base_class(self, fd):
+        """
+        class of base specifier fd, or for a specialization like Base<int>, which has no children, its template
+        """
+        for child in fd.get_children():
+            if child.kind == CK.TEMPLATE_REF and child.referenced is not None:
+                return child.referenced
+        return fd.get_definition()
+
+    def is_range(self, fd):
+        """
+        is field fd an array, a std container or a class with a begin() member?
+        """
+        canonical = fd.type.get_canonical()
+        if canonical.kind in ARRAY_TYPE_KINDS:
+            return True
+        # the type as spelled in the declaration, before the field name
+        type_tokens = []
+        for tok in fd.get_tokens():
+            if tok.spelling == fd.spelling:
+                break
+            type_tokens.append(tok.spelling)
+        if CONTAINER_PATTERN.search(fd.type.spelling) or CONTAINER_PATTERN.search(" ".join(type_tokens)):
+            return True
+        node = canonical.get_declaration()
+        for child in fd.get_children():
+            # a specialization like Box<int> has no children, but its template does
+            if child.kind == CK.TEMPLATE_REF and child.referenced is not None:
+                node = child.referenced
+        return any(
+            child.kind in (CK.CXX_METHOD, CK.FUNCTION_TEMPLATE) and child.spelling == "begin"
+            for child in node.get_children()
+        )
+
+    def can_delegate(self, node):
+        """
+        does base class node have a to_string, or get one generated, so derived classes can print it?
+        """
+        if node is None:
+            return False
+        for fd in node.get_children():
+            if fd.kind == CK.CXX_METHOD and fd.spelling == "to_string":
+                return True
+        return self.is_editable(node.location.file.name) and self.has_fields(node)
+
+    def has_fields(self, node):
+        """
+        are there any variables to print in node or its bases
+        """
+        if node is None:
+            return False
+        if node.kind == CK.CLASS_TEMPLATE:
+            return True
+        for fd in node.get_children():
+            if fd.kind == CK.FIELD_DECL or fd.kind == CK.VAR_DECL:
+                return True
+            if fd.kind == CK.CXX_BASE_SPECIFIER and self.has_fields(fd.get_definition()):
+                return True
+        return False
+
     def extract_one_class_record(self, node):
         """create ClassRecord for suitable nodes"""
 
@@ -525,6 +923,9 @@ class ParseCPP:
             class_record.access_specifier == "PUBLIC"
         else:
             class_record.access_specifier = node.access_specifier.name
+        namespacelist = self.get_parent_namespaces(node)
+        if namespacelist:
+            class_record.namespace = "::".join(namespacelist)
 
         # now find closing brace so we can inject 'friend' or 'to_string()'
         *_, last_tok = node.get_tokens()
@@ -537,6 +938,10 @@ class ParseCPP:
         if last_tok.location.file.name in self.file_has_existing_formatters:
             return
 
+        # code is only generated in the defining file, skip extraction everywhere else
+        if not self.is_defined_here(node, last_tok):
+            return
+
         # skip if this class already has a pre-existing to_string function
         for fd in node.get_children():
             if fd.kind == CK.CXX_METHOD and fd.spelling == "to_string":
@@ -577,10 +982,11 @@ class ParseCPP:
 
                     class_record.tvars.append(tvar_record)
 
-        class_record.vars = self.extract_vars_from_class(node, prefix="", indent=0)
+        base_types = class_record.base_types if self.delegate_bases else None
+        class_record.vars = self.extract_vars_from_class(node, prefix="", indent=0, base_types=base_types)
         self.mark_base_classes_with_protected_vars(class_record)
 
-        if len(class_record.vars) > 0 or len(class_record.tvars) > 0:
+        if len(class_record.vars) > 0 or len(class_record.tvars) > 0 or len(class_record.base_types) > 0:
             self.class_records.append(class_record)
 
     def mark_base_classes_with_protected_vars(self, class_record):
@@ -623,7 +1029,7 @@ class ParseCPP:
         mark external definitions in include files
         """
         for rec in self.class_records:
-            rec.is_external = rec.last_tok.location.file.name != self.filename
+            rec.is_external = not self.is_editable(rec.last_tok.location.file.name)
 
         """
         remove records if last_tok is None, ie just forward declarations
@@ -672,3 +1078,20 @@ class ParseCPP:
                         if "struct fmt :: formatter" in tokens:
                             if fd.location.file.name not in self.file_has_existing_formatters:
                                 self.file_has_existing_formatters.add(fd.location.file.name)
+
+
+def parse_files(jobs, extraargs, max_workers=None, cache=None):
+    """
+    parse [code, filename] jobs on a pool of threads
+
+    libclang releases the GIL while it parses, so threads overlap without pickling
+    records between processes. Returns (string, enum, class) records in job order.
+    """
+    cache = cache if cache is not None else Cache()
+
+    def parse_one(job):
+        code, filename = job
+        return ParseCPP(code, filename, extraargs, cache=cache).extract_interesting_records()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(parse_one, jobs))
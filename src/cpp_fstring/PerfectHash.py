@@ -0,0 +1,93 @@
+"""
+    @file  PerfectHash.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Minimal perfect hash of a fixed set of names, computed at generation time
+    for lookups in generated code.
+
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+FNV_OFFSET = 0x811C9DC5
+FNV_PRIME = 0x01000193
+
+
+def perfect_hash(name, seed):
+    """
+    32 bit FNV-1a of name with seed mixed into the offset basis, same as fstr::perfect_hash in fstr.h
+
+    low bits of FNV-1a only depend on low bits of its input, so the murmur3 finalizer
+    mixes in the high bits before the hash is taken modulo a small table size
+    """
+    value = FNV_OFFSET ^ seed
+    for byte in name.encode("utf8"):
+        value = ((value ^ byte) * FNV_PRIME) & 0xFFFFFFFF
+    value ^= value >> 16
+    value = (value * 0x85EBCA6B) & 0xFFFFFFFF
+    value ^= value >> 13
+    value = (value * 0xC2B2AE35) & 0xFFFFFFFF
+    value ^= value >> 16
+    return value
+
+
+class PerfectHash:
+    """
+    hash and displace: names are put in buckets by perfect_hash(name, 0), and each
+    bucket gets a seed that moves all of its names to free slots. Buckets of one name
+    are placed directly in a free slot, stored as a negative seed -slot-1.
+
+    .. code-block:: CPP
+
+        seed = seeds[perfect_hash(name, 0) % size]
+        slot = seed < 0 ? -seed - 1 : perfect_hash(name, seed) % size
+
+    every name lands in its own slot, and names[slot] == name tells if it is one of them.
+    """
+
+    def __init__(self, names, **kwargs):
+        self.size = len(names)
+        self.seeds = [0] * self.size
+        self.slots = [None] * self.size
+
+        buckets = [[] for _ in range(self.size)]
+        for name in names:
+            buckets[perfect_hash(name, 0) % self.size].append(name)
+
+        # largest buckets first, while most slots are still free
+        order = sorted(range(self.size), key=lambda index: -len(buckets[index]))
+        for index in order:
+            bucket = buckets[index]
+            if len(bucket) <= 1:
+                break
+            seed = 1
+            while True:
+                slots = {perfect_hash(name, seed) % self.size for name in bucket}
+                if len(slots) == len(bucket) and all(self.slots[slot] is None for slot in slots):
+                    break
+                seed += 1
+            for name in bucket:
+                self.slots[perfect_hash(name, seed) % self.size] = name
+            self.seeds[index] = seed
+
+        free = [slot for slot in range(self.size) if self.slots[slot] is None]
+        for index in order:
+            if len(buckets[index]) == 1:
+                slot = free.pop()
+                self.slots[slot] = buckets[index][0]
+                self.seeds[index] = -slot - 1
+
+    def get_slot(self, name):
+        seed = self.seeds[perfect_hash(name, 0) % self.size]
+        return -seed - 1 if seed < 0 else perfect_hash(name, seed) % self.size
@@ -0,0 +1,84 @@
+"""
+    @file  Prescan.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Byte level prescan that decides if a file needs a libclang parse at all.
+
+"""
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+
+class Prescan:
+    """
+    a file can only produce changes if it has at least one of:
+
+        - a string literal containing { or }
+        - an enum/class/struct/union keyword outside comments and literals
+
+    everything else is passed through without parsing. Comments, raw strings,
+    char literals and digit separators (1'000) are skipped so that quotes and
+    keywords inside them are not misread. Keywords only introduced by macros
+    defined in other files are not seen, use --no-prescan for such code.
+    """
+
+    # only try at quotes, comments, dots and word starts, so identifiers are skipped at regex speed.
+    # raw strings are only matched up to the opening paren, the rest is found with bytes.find
+    pattern = re.compile(
+        rb"""(?=[/"'.]|\b\w)(?:
+          (?P<comment>    //[^\n\\]*(?:\\(?:\r\n|.)[^\n\\]*)* | /\*.*?(?:\*/|\Z) )
+        | (?P<raw>        (?:u8|[uUL])?R"(?P<delim>[^()\\\s"]{0,16})\( )
+        | (?P<string>     "[^"\\\n]*(?:\\(?:\r\n|.)[^"\\\n]*)*" )
+        | (?P<char>       '[^'\\\n]*(?:\\(?:\r\n|.)[^'\\\n]*)*' )
+        | (?P<number>     (?<![\w.])\.?[0-9](?:[eEpP][+-]|[\w.])*'(?:[eEpP][+-]|'(?=\w)|[\w.])* )
+        | (?P<keyword>    (?:enum|class|struct|union)\b )
+        )""",
+        re.VERBOSE | re.DOTALL,
+    )
+
+    def get_reason(self, data):
+        """
+        return first construct that could produce a change, or None if there is nothing to rewrite
+        """
+        pos = 0
+        while True:
+            match = self.pattern.search(data, pos)
+            if match is None:
+                return None
+            kind = match.lastgroup
+            pos = match.end()
+            if kind == "string":
+                if b"{" in match[0] or b"}" in match[0]:
+                    return match[0]
+            elif kind == "keyword":
+                return match[0]
+            elif kind == "raw":
+                end_marker = b")" + match["delim"] + b'"'
+                end = data.find(end_marker, pos)
+                end = len(data) if end < 0 else end + len(end_marker)
+                if b"{" in data[pos:end] or b"}" in data[pos:end]:
+                    return data[match.start() : end]
+                pos = end
+
+    def needs_parse(self, data):
+        """
+        True unless data provably has nothing to rewrite
+        """
+        if isinstance(data, str):
+            data = data.encode("utf8", errors="surrogateescape")
+        reason = self.get_reason(data)
+        if reason is not None:
+            log.debug(f"prescan found {reason[:40]!r}")
+        return reason is not None
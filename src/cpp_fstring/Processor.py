@@ -1,3 +1,4 @@
+import fnmatch
 import logging
 import re
 from collections import defaultdict
@@ -28,6 +29,27 @@ class Processor:
         # https://regex101.com/r/5cY7CW/1
         self.pattern = r"(\{)([^}:]+)(?=(:[^}]+)?(\}))"
         self.vars = []
+        self.enum_format = args.enum_format if args else "switch"
+        self.enum_from_string = args.enum_from_string if args else False
+        self.to_string_style = args.to_string_style if args else "runtime"
+        self.format_to = args.format_to if args else False
+        self.fstring_style = args.fstring_style if args else "runtime"
+        self.binary_schema = args.binary_schema if args else None
+        self.max_elements = args.max_elements if args else None
+        # [pattern, limit] of --max-elements-for, matched against field names and types
+        self.max_elements_for = args.max_elements_for if args else []
+        # [kind, name, entry] of each class and enum that binary encodings can be decoded with
+        self.schema = []
+        # [kind, record name, namespace, code, token, is_appended] of each piece of generated code
+        self.artifacts = []
+
+    def add_artifact(self, kind, rec, code, tok, is_appended=False):
+        """
+        remember generated code for the size report: tok is where it is inserted,
+        or for code appended to the end of file, the end of the record it came from
+        """
+        if code:
+            self.artifacts.append([kind, rec.name, rec.namespace, code, tok, is_appended])
 
     def get_char_replacements(self, in_str):
         """
@@ -76,7 +98,9 @@ class Processor:
                             ------ f_str ------  -v_str-
             """
             # in_str = repr(rec.value)[1:-1]  # escape backslash
-            in_str = rec.spelling
+            # StreamRecords span from the stream to the end of the literal
+            stream = getattr(rec, "stream", None)
+            in_str = rec.literal if stream else rec.spelling
 
             (lbracket, rbracket, doublecolon) = self.get_char_replacements(in_str)
             rbacket_rev = rbracket[::-1]
@@ -101,7 +125,15 @@ class Processor:
             if self.vars:
                 v_str = ", ".join(self.vars)
                 v_str = v_str.replace(doublecolon, "::")
-                replacement_str = f"fmt::format({f_str}, {v_str})"
+                if stream:
+                    replacement_str = self.gen_print_to_stream(rec, f_str, v_str)
+                elif getattr(rec, "call", None):
+                    # logging calls take the format string and args, and only format when enabled
+                    replacement_str = f"{f_str}, {v_str}"
+                else:
+                    replacement_str = f"fmt::format({self.get_fstring_format(f_str)}, {v_str})"
+            elif stream:
+                replacement_str = rec.spelling[: -len(rec.literal)] + f_str
             else:
                 replacement_str = f_str
 
@@ -109,6 +141,40 @@ class Processor:
 
         return changes
 
+    def gen_print_to_stream(self, rec, f_str, v_str):
+        """
+        with --print-to-stream, format straight into the stream instead of into a temporary
+        string that is then streamed. fmt::print doesn't take FMT_COMPILE strings, those
+        are written with fmt::format_to to an ostreambuf_iterator. Following << continue
+        the statement after a comma.
+        """
+        format_str = self.get_fstring_format(f_str)
+        if format_str.startswith("FMT_COMPILE("):
+            out = f"fmt::format_to(std::ostreambuf_iterator<char>({rec.stream}), {format_str}, {v_str})"
+        else:
+            out = f"fmt::print({rec.stream}, {format_str}, {v_str})"
+        if rec.is_chained:
+            out += f", {rec.stream}"
+        return out
+
+    def get_fstring_format(self, f_str):
+        """
+        with --fstring-style checked or compiled, wrap the literal in FMT_STRING or FMT_COMPILE.
+
+        literals that either can't take are left as runtime format strings: anything but
+        plain or raw char literals (eg L"", u8"", user-defined literals), and nested
+        replacement fields like {x:{width}}, whose spec is only known at runtime
+        """
+        if self.fstring_style == "runtime":
+            return f_str
+        if not (f_str.startswith(('"', 'R"')) and f_str.endswith('"')):
+            return f_str
+        unescaped = f_str.replace("{{", "").replace("}}", "")
+        if re.search(r"\{[^}]*\{", unescaped):
+            return f_str
+        macro = "FMT_STRING" if self.fstring_style == "checked" else "FMT_COMPILE"
+        return f"{macro}({f_str})"
+
     def gen_class_changes_old(self, records):
         """
         add a friend format statement to classes with private vars
@@ -153,6 +219,7 @@ class Processor:
         for rec in records:
             if not rec.is_external and rec.needs_to_string:
                 replacement_str = self.gen_to_string(rec)
+                self.add_artifact("to_string", rec, replacement_str, rec.last_tok)
                 replacement_str += rec.last_tok.spelling
                 changes.append([rec.last_tok, replacement_str])
         """
@@ -162,6 +229,7 @@ class Processor:
             if not rec.is_external:
                 for base in rec.bases:
                     replacement_str = self.gen_class_derived_friend_string(base, rec)
+                    self.add_artifact("friend", rec, replacement_str, base.last_tok)
                     replacement_str += base.last_tok.spelling
                     changes.append([base.last_tok, replacement_str])
 
@@ -209,9 +277,15 @@ class Processor:
         # skip if anon
         if rec.is_anonymous:
             return ""
+        self.add_enum_schema(rec)
         out = self.gen_enum_header_comment(rec)
         out += " friend "
-        out += self.gen_enum_switch_statement(rec)
+        out += self.gen_enum_function(rec)
+        self.add_artifact("format_as", rec, out, rec.class_last_tok)
+        if self.enum_from_string and rec.values:
+            parser_str = " friend " + self.gen_enum_from_string(rec)
+            self.add_artifact("from_string", rec, parser_str, rec.class_last_tok)
+            out += parser_str
         return out
 
     def gen_to_string(self, rec):
@@ -238,7 +312,8 @@ class Processor:
             var.out += f"{var.name}={{}}"
             last_vartype = var.vartype
 
-        vars_outlist = [var.out for var in vars]
+        # with --inherited-fields delegate, bases print themselves, in braces
+        vars_outlist = ["{{{}}}" for _ in rec.base_types] + [var.out for var in vars]
 
         # assemble the format string
         fmt_string = f"{decl_expand}: "
@@ -249,7 +324,7 @@ class Processor:
         # deal with pointers using fmt::ptr
         # deal with special cases of derived variables in class templates using this->
         # TODO: only use this-> for class templates
-        paramlist = tvars
+        paramlist = tvars + [f"static_cast<const {base}&>(*this)" for base in rec.base_types]
         for var in vars:
             if var.indent > 0:
                 name = f"this->{var.name}"
@@ -258,21 +333,104 @@ class Processor:
 
             if var.is_pointer:
                 paramlist.append(f"fmt::ptr({name})")
+            elif var.is_range and var.max_elements is not None:
+                paramlist.append(f"fstr::bound({name}, {var.max_elements})")
             else:
                 paramlist.append(name)
 
-        param_string = ""
-        if paramlist:
-            param_string = ", " + ", ".join(paramlist)
-
         out = f"""  // Generated to_string() for {rec.access_specifier} {rec.class_kind} {decl_str}
   public:
+"""
+        if self.binary_schema:
+            names = tvars + rec.base_types + [var.name for var in vars]
+            types = [""] * (len(paramlist) - len(vars)) + [var.vartype for var in vars]
+            out += self.gen_encode(rec, fmt_string, paramlist, names, types)
+        if self.format_to:
+            out += self.gen_format_to(fmt_string, paramlist)
+            return out
+        out += """  auto to_string() const {
+"""
+        out += self.gen_to_string_body(fmt_string, paramlist)
+        out += """  }
+"""
+        return out
+
+    def gen_encode(self, rec, fmt_string, paramlist, names, types):
+        """
+        with --binary-schema, an encode() member that appends the params of to_string() to
+        any byte buffer with an append(begin, end), eg std::string or fmt::memory_buffer,
+        without formatting them. The schema keeps fmt_string, so Decoder can produce the
+        text of to_string() offline.
+        """
+        from cpp_fstring.PerfectHash import perfect_hash
+
+        type_id = perfect_hash(rec.name, 0)
+        fields = [{"name": name, "type": vartype} for name, vartype in zip(names, types)]
+        self.schema.append(["class", f"{type_id:08x}", {"name": rec.name, "format": fmt_string, "fields": fields}])
+        # the buffer is named so it can't hide a field named out
+        lines = "".join(f"    fstr::encode(fstr_out_, {param});\n" for param in paramlist)
+        return f"""  template <typename Buffer>
+  void encode(Buffer& fstr_out_) const {{
+    fstr::encode_id(fstr_out_, 0x{type_id:08x}u);
+{lines}  }}
+"""
+
+    def add_enum_schema(self, rec):
+        """
+        with --binary-schema, names of enum values, the first one of duplicates like format_as
+        """
+        if not self.binary_schema or (not self.has_valid_index(rec) and len(rec.values) != 1):
+            return
+        values = {}
+        for elem in rec.values:
+            values.setdefault(str(elem.index), elem.name)
+        self.schema.append(["enum", rec.name, {"values": values}])
+
+    def gen_format_to(self, fmt_string, paramlist):
+        """
+        with --format-to, write straight into any output iterator, eg the fmt::appender of a
+        fmt::memory_buffer, and only wrap that in to_string(). fstr.h formats classes
+        with a format_to member with it, so nested classes don't make temporary strings.
+        """
+        if self.to_string_style == "runtime":
+            format_str = f'fmt::runtime("{fmt_string}")'
+        else:
+            format_str = f'{self.get_format_macro()}("{fmt_string}")'
+        param_string = "".join(f", fstr::safe_arg({param})" for param in paramlist)
+        # the iterator and string are named so they can't hide a field named out
+        return f"""  template <typename OutputIt>
+  OutputIt format_to(OutputIt fstr_out_) const {{
+    return fmt::format_to(fstr_out_, {format_str}{param_string});
+  }}
   auto to_string() const {{
-    const std::string fmt_string = "{fmt_string}";
-    return fstr::format(fmt_string{param_string});
+    std::string fstr_out_;
+    format_to(std::back_inserter(fstr_out_));
+    return fstr_out_;
   }}
 """
-        return out
+
+    def get_format_macro(self):
+        return "FMT_STRING" if self.to_string_style == "checked" else "FMT_COMPILE"
+
+    def gen_to_string_body(self, fmt_string, paramlist):
+        """
+        format statement of to_string in the --to-string-style:
+
+            runtime  : the format string is a std::string, checked and parsed on every call
+            checked  : FMT_STRING, checked at build time
+            compiled : FMT_COMPILE, checked and parsed at build time
+
+        checked and compiled styles keep the types of params, with fstr::safe_arg turning
+        un-formattable ones into <unknown>, so the format string can be checked against them
+        """
+        if self.to_string_style == "runtime":
+            param_string = "".join(f", {param}" for param in paramlist)
+            return f"""    const std::string fmt_string = "{fmt_string}";
+    return fstr::format(fmt_string{param_string});
+"""
+        param_string = "".join(f", fstr::safe_arg({param})" for param in paramlist)
+        return f"""    return fmt::format({self.get_format_macro()}("{fmt_string}"){param_string});
+"""
 
     def gen_enum_format(self, records):
         """
@@ -294,9 +452,13 @@ class Processor:
                 continue
             nslist.add(rec.namespace)
 
+        # sorted, so output bytes don't depend on the hash seed
         out = "\n"
-        for ns in nslist:
-            out += f"namespace {ns} {{using ::format_as;}}\n"
+        for ns in sorted(nslist):
+            if self.enum_from_string:
+                out += f"namespace {ns} {{using ::format_as; using ::from_string;}}\n"
+            else:
+                out += f"namespace {ns} {{using ::format_as;}}\n"
 
         return out
 
@@ -314,6 +476,7 @@ class Processor:
         # skip if already a friend statement
         if rec.is_in_class or rec.is_in_function:
             return ""
+        self.add_enum_schema(rec)
 
         # comment out private enums..
         out = ""
@@ -322,8 +485,14 @@ class Processor:
         if comment_out:
             out += f"\n/******************* {rec.access_specifier} **\n"
 
-        out += self.gen_enum_header_comment(rec)
-        out += self.gen_enum_switch_statement(rec)
+        format_str = self.gen_enum_header_comment(rec)
+        format_str += self.gen_enum_function(rec)
+        self.add_artifact("format_as", rec, format_str, rec.last_tok, is_appended=True)
+        out += format_str
+        if self.enum_from_string:
+            parser_str = self.gen_enum_from_string(rec)
+            self.add_artifact("from_string", rec, parser_str, rec.last_tok, is_appended=True)
+            out += parser_str
 
         if comment_out:
             out += f"\n******************** {rec.access_specifier} */\n"
@@ -339,6 +508,169 @@ class Processor:
             f"// Generated formatter for {rec.access_specifier} enum {rec.name} of type {rec.enum_type} {scoped_str}\n"
         )
 
+    def has_valid_index(self, rec):
+        """
+        enum values that are all the same (eg all 0) probably weren't evaluated
+        """
+        return len({elem.index for elem in rec.values}) > 1
+
+    def gen_enum_function(self, rec):
+        """
+        format_as as a switch, or with --enum-format table as a lookup table when
+        the values are known. Values in class templates can depend on template
+        arguments, so those stay a switch on names.
+        """
+        if self.enum_format == "table" and "<" not in rec.name:
+            if self.has_valid_index(rec) or len(rec.values) == 1:
+                return self.gen_enum_table_statement(rec)
+        return self.gen_enum_switch_statement(rec)
+
+    def get_int_literal(self, value):
+        """
+        C++ literal of an enum value, suffixed where a plain decimal literal doesn't fit a long long
+        """
+        if value >= 2**63:
+            return f"{value}ull"
+        if value == -(2**63):
+            return f"({value + 1}ll - 1)"
+        return str(value)
+
+    def gen_enum_table_statement(self, rec):
+        """
+        create a format_as statement that looks up names by enum value
+
+        dense values (at most half of the range missing) index an array directly:
+
+        .. code-block:: CPP
+
+            enum class color {red, green, blue = 3};
+            inline auto format_as(const color obj) {
+              static constexpr const char* names[] = {
+                "red",        // 0
+                "green",      // 1
+                "<missing>",  // 2
+                "blue",       // 3
+              };
+              const auto index = static_cast<std::size_t>(static_cast<std::underlying_type_t<color>>(obj)) -
+                                 static_cast<std::size_t>(0);
+              return fmt::string_view(index < sizeof(names) / sizeof(names[0]) ? names[index] : "<missing>");
+            }
+
+        sparse values are binary searched in a table sorted by value. The first name of
+        duplicate values wins, like in the switch.
+        """
+        decl = rec.name
+        names = {}
+        for elem in rec.values:
+            names.setdefault(int(elem.index), elem.name)
+        values = sorted(names)
+        low, high = values[0], values[-1]
+
+        out = f"""inline auto format_as(const {decl} obj) {{
+"""
+        if high - low < 2 * len(values):
+            out += """  static constexpr const char* names[] = {
+"""
+            width = max([len(name) for name in names.values()] + [len("<missing>")]) + 3
+            lines = []
+            for value in range(low, high + 1):
+                name_in_quotes = f'"{names.get(value, "<missing>")}",'
+                lines.append(f"    {name_in_quotes:<{width}}  // {value}\n")
+            out += "".join(lines)
+            out += f"""  }};
+  const auto index = static_cast<std::size_t>(static_cast<std::underlying_type_t<{decl}>>(obj)) -
+                     static_cast<std::size_t>({self.get_int_literal(low)});
+  return fmt::string_view(index < sizeof(names) / sizeof(names[0]) ? names[index] : "<missing>");
+}}
+"""
+            return out
+
+        out += f"""  using underlying = std::underlying_type_t<{decl}>;
+  struct entry {{
+    underlying value;
+    const char* name;
+  }};
+  // sorted by value
+  static constexpr entry table[] = {{
+"""
+        out += "".join(f'    {{{self.get_int_literal(value)}, "{names[value]}"}},\n' for value in values)
+        out += """  };
+  const auto value = static_cast<underlying>(obj);
+  std::size_t low = 0;
+  std::size_t high = sizeof(table) / sizeof(table[0]);
+  while (low < high) {
+    const std::size_t mid = low + (high - low) / 2;
+    if (table[mid].value < value) {
+      low = mid + 1;
+    } else {
+      high = mid;
+    }
+  }
+  const bool found = low < sizeof(table) / sizeof(table[0]) && table[low].value == value;
+  return fmt::string_view(found ? table[low].name : "<missing>");
+}
+"""
+        return out
+
+    def get_enum_prefix(self, rec):
+        """
+        if scoped and name of enum decl is A::B::my_enum then inherit the whole name
+        if not scoped, leave out the my_enum part
+        """
+        if rec.is_scoped:
+            return f"{rec.name}::"
+        separator = "::"
+        prefix = separator.join(rec.name.rsplit(separator, 1)[:-1]) + separator
+        return "" if prefix == separator else prefix
+
+    def gen_enum_from_string(self, rec):
+        """
+        create a from_string statement that finds enum values by name with a perfect
+        hash computed here, so a lookup is one hash and one compare
+
+        .. code-block:: CPP
+
+            enum class color {red, green, blue};
+            inline bool from_string(fmt::string_view name, color& obj) {
+              static constexpr int seeds[] = {-3, -2, -1};
+              static constexpr const char* names[] = {"green", "blue", "red"};
+              static constexpr color values[] = {color::green, color::blue, color::red};
+              const int seed = seeds[fstr::perfect_hash(name, 0) % 3];
+              const std::size_t slot =
+                  seed < 0 ? -seed - 1 : fstr::perfect_hash(name, static_cast<std::uint32_t>(seed)) % 3;
+              if (name != names[slot]) {
+                return false;
+              }
+              obj = values[slot];
+              return true;
+            }
+        """
+        from cpp_fstring.PerfectHash import PerfectHash
+
+        decl = rec.name
+        prefix = self.get_enum_prefix(rec)
+        names = list(dict.fromkeys(elem.name for elem in rec.values))
+        table = PerfectHash(names)
+        size = table.size
+
+        seeds = ", ".join(str(seed) for seed in table.seeds)
+        names_str = ", ".join(f'"{name}"' for name in table.slots)
+        values_str = ", ".join(f"{prefix}{name}" for name in table.slots)
+        return f"""inline bool from_string(fmt::string_view name, {decl}& obj) {{
+  static constexpr int seeds[] = {{{seeds}}};
+  static constexpr const char* names[] = {{{names_str}}};
+  static constexpr {decl} values[] = {{{values_str}}};
+  const int seed = seeds[fstr::perfect_hash(name, 0) % {size}];
+  const std::size_t slot =
+      seed < 0 ? -seed - 1 : fstr::perfect_hash(name, static_cast<std::uint32_t>(seed)) % {size};
+  if (name != names[slot]) {{
+    return false;
+  }}
+  obj = values[slot];
+  return true;
+}}
+"""
+
     def gen_enum_switch_statement(self, rec):
         """
         create a format_as statement based on enum definition
@@ -373,36 +705,28 @@ struct fmt::formatter<{decl}>: formatter<string_view> {{
     string_view name = "<unknown>";
     switch (val) {{
 """
-        # if scoped and name of enum decl is A::B::my_enum then inherit the whole name
-        # if not scoped, leave out the my_enum part
-        if rec.is_scoped:
-            prefix = f"{decl}::"
-        else:
-            separator = "::"
-            prefix = separator.join(decl.rsplit(separator, 1)[:-1]) + separator
-            if prefix == separator:
-                prefix = ""
+        prefix = self.get_enum_prefix(rec)
 
         # if all index values are zero, its probably a problem
-        seen_index = set()
-        for elem in rec.values:
-            seen_index.add(elem.index)
-        is_valid_index = len(seen_index) > 1
+        is_valid_index = self.has_valid_index(rec)
 
+        # one pass over values, so huge enums are generated in linear time
+        width = max([len(x.name) for x in rec.values], default=0)
+        lines = []
         seen_index = set()
         for elem in rec.values:
             is_duplicate = elem.index in seen_index
             seen_index.add(elem.index)
 
-            width = max([len(x.name) for x in rec.values])
             name_in_quotes = f'"{elem.name}"'
             line = (
                 f"case {prefix}{elem.name:<{width}}: name = {name_in_quotes:<{width+2}}; break;  // index={elem.index}"
             )
             if is_duplicate and is_valid_index:
-                out += f"//  {line} <-- index is duplicate\n"
+                lines.append(f"//  {line} <-- index is duplicate\n")
             else:
-                out += f"    {line}\n"
+                lines.append(f"    {line}\n")
+        out += "".join(lines)
 
         out += """  }
   return name;
@@ -545,10 +869,24 @@ struct fmt::formatter<{decl}>: formatter<string_view> {{
         for var in rec.vars:
             if var.displayname not in seen:
                 if var.access_specifier == "PUBLIC" or not rec.is_external:
+                    var.max_elements = self.get_max_elements(rec, var)
                     vars.append(var)
                     seen.add(var.displayname)
         return vars
 
+    def get_max_elements(self, rec, var):
+        """
+        most elements to print of a container or array field: the last --max-elements-for
+        pattern that matches the field name, Class::name or its type, else --max-elements.
+        A negative limit means no limit.
+        """
+        limit = self.max_elements
+        for pattern, pattern_limit in self.max_elements_for:
+            for target in [var.name, f"{rec.name}::{var.name}", var.vartype]:
+                if target == pattern or fnmatch.fnmatchcase(target, pattern):
+                    limit = pattern_limit
+        return None if limit is None or limit < 0 else limit
+
     def gen_one_class(self, rec):
         """
         follow example in fmt:: documentation
@@ -0,0 +1,110 @@
+"""
+    @file  SizeReport.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Size of generated code by the class or enum it came from, totaled per file
+    and per namespace, to see where generation costs the most compile time.
+
+"""
+import json
+import logging
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+HEADER_EXTENSIONS = (".h", ".hh", ".hpp", ".hxx", ".h++", ".inl")
+GLOBAL = "(global)"
+
+
+def record_artifact(stats, file, offset, kind, name, namespace, code):
+    """
+    add one piece of generated code to stats
+
+    like the histograms in Metrics, artifacts are plain counters keyed by everything
+    the report needs. A header rendered by several files gives the same key, so it is
+    only reported once.
+    """
+    size = len(code.encode("utf8"))
+    lines = code.count("\n")
+    stats[("artifact", file, offset, kind, name, namespace or GLOBAL, lines, size)] += 1
+
+
+class SizeReport:
+    """
+    report on artifacts collected by record_artifact, largest first
+    """
+
+    def __init__(self, stats, **kwargs):
+        self.artifacts = []
+        for key in stats:
+            if isinstance(key, tuple) and key[0] == "artifact":
+                _, file, offset, kind, name, namespace, lines, size = key
+                self.artifacts.append(
+                    {
+                        "file": file,
+                        "offset": offset,
+                        "kind": kind,
+                        "record": name,
+                        "namespace": namespace,
+                        "lines": lines,
+                        "bytes": size,
+                        "in_header": file.endswith(HEADER_EXTENSIONS),
+                    }
+                )
+        self.artifacts.sort(key=lambda item: (-item["bytes"], item["file"], item["offset"]))
+
+    def get_totals(self, field):
+        """
+        {file or namespace: {lines, bytes, artifacts}} largest first
+        """
+        totals = {}
+        for item in self.artifacts:
+            total = totals.setdefault(item[field], Counter())
+            total.update(lines=item["lines"], bytes=item["bytes"], artifacts=1)
+        return {name: dict(total) for name, total in sorted(totals.items(), key=lambda item: -item[1]["bytes"])}
+
+    def get_record(self):
+        return {
+            "artifacts": self.artifacts,
+            "files": self.get_totals("file"),
+            "namespaces": self.get_totals("namespace"),
+        }
+
+    def get_text(self):
+        lines = ["# generated code per artifact"]
+        lines.append(f"{'bytes':>8} {'lines':>6}  {'where':<6}  {'kind':<9}  {'record':<30}  file")
+        for item in self.artifacts:
+            where = "header" if item["in_header"] else "source"
+            lines.append(
+                f"{item['bytes']:>8} {item['lines']:>6}  {where:<6}  {item['kind']:<9}  "
+                f"{item['record']:<30}  {item['file']}"
+            )
+        for field in ["file", "namespace"]:
+            lines.append("")
+            lines.append(f"# total per {field}")
+            lines.append(f"{'bytes':>8} {'lines':>6} {'count':>6}  {field}")
+            for name, total in self.get_totals(field).items():
+                lines.append(f"{total['bytes']:>8} {total['lines']:>6} {total['artifacts']:>6}  {name}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        json if path ends in .json, otherwise a text table
+        """
+        with open(path, "w", encoding="utf8") as f:
+            if path.endswith(".json"):
+                json.dump(self.get_record(), f, indent=2)
+                f.write("\n")
+            else:
+                f.write(self.get_text())
+        log.info(f"size report of {len(self.artifacts)} artifacts written to {path}")
@@ -0,0 +1,89 @@
+"""
+    @file  SymbolTable.py
+    @author  Sandeep <deep@tensorfield.ag>
+    @version 1.0
+
+    @section LICENSE
+
+    MIT License <http://opensource.org/licenses/MIT>
+
+    @section DESCRIPTION
+
+    https://github.com/d-e-e-p/cpp-fstring
+    Copyright (c) 2023 Sandeep <deep@tensorfield.ag>
+
+    Classes and enums seen across all TUs of a run, keyed by clang USR.
+
+"""
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class SymbolTable:
+    """
+    record each class/enum of an allow-listed header once, with the file that defines it
+
+    .. code-block::
+
+        symbols[usr] = [name, kind, defining_file]
+
+    the first TU that sees a symbol generates its code and renders its header, so every
+    later sighting is a duplicate that skips extraction altogether. Symbols are tracked
+    per process: batch workers each have their own table, and Batch drops headers that
+    more than one of them rendered.
+    """
+
+    def __init__(self, **kwargs):
+        self.lock = threading.Lock()
+        self.symbols = {}
+        self.files = set()
+
+    def clear(self):
+        with self.lock:
+            self.symbols.clear()
+            self.files.clear()
+
+    def add(self, usr, name, kind, file):
+        """
+        return True the first time usr is seen
+        """
+        if not usr:
+            return True
+        with self.lock:
+            if usr in self.symbols:
+                return False
+            self.symbols[usr] = [name, kind, file]
+            return True
+
+    def get_state(self):
+        """
+        copy of the table, eg to hand to a budget child process and back
+        """
+        with self.lock:
+            return [dict(self.symbols), set(self.files)]
+
+    def merge(self, state):
+        """
+        add the symbols and files of a get_state() copy, keeping the ones already seen
+        """
+        other_symbols, other_files = state
+        with self.lock:
+            for usr, entry in other_symbols.items():
+                self.symbols.setdefault(usr, entry)
+            self.files.update(other_files)
+
+    def add_file(self, file):
+        """
+        return True the first time file is seen, eg so a header is only rendered once
+        """
+        with self.lock:
+            if file in self.files:
+                return False
+            self.files.add(file)
+            return True
+
+
+# shared by all parses of this process, ie by all files of a batch run on threads
+symbols = SymbolTable()
@@ -10,18 +10,22 @@ The 3 phases of conversion are:
         - phase2: decide what lines need to be modified and what file appends need to be made
         - phase3: execute these changes in the input file and write modified code to stdout
 
+Modules doing the real work (and clang.cindex) are only imported once they are needed,
+so --version, --help and output cache hits never load libclang.
 
 """
 
 import argparse
+import io
 import logging
+import mmap
+import os
 import sys
-
-from cpp_fstring.GenerateOutput import GenerateOutput
+import time
+from collections import Counter
+from contextlib import contextmanager
 
 # from cpp_fstring import __version__
-from cpp_fstring.ParseCPP import ParseCPP
-from cpp_fstring.Processor import Processor
 
 __version__ = "0.1.1"
 __author__ = "d-e-e-p"
@@ -30,6 +34,34 @@ __license__ = "MIT"
 
 log = logging.getLogger(__name__)
 
+# command line options that change output, and so are part of the cache key
+OUTPUT_OPTIONS = [
+    "emit",
+    "edit_headers",
+    "literals_only",
+    "enum_format",
+    "enum_from_string",
+    "to_string_style",
+    "format_to",
+    "fstring_style",
+    "print_to_stream",
+    "log_calls",
+    "binary_schema",
+    "max_elements",
+    "max_elements_for",
+    "inherited_fields",
+]
+
+
+def get_pattern_limit(text):
+    """
+    PATTERN=N of --max-elements-for, split at the last = since types can have = in them
+    """
+    pattern, _, limit = text.rpartition("=")
+    if not pattern or not limit.lstrip("-").isdigit():
+        raise argparse.ArgumentTypeError(f"expected PATTERN=N, got {text!r}")
+    return [pattern, int(limit)]
+
 
 def parse_args(args):
     """Parse command line parameters
@@ -62,8 +94,220 @@ def parse_args(args):
         const=logging.DEBUG,
     )
     parser.add_argument(
-        "filename",
-        help="name of file to process",
+        "--cache-dir",
+        dest="cache_dir",
+        help="reuse output of previous runs stored in this dir",
+        default=None,
+    )
+    parser.add_argument(
+        "--no-prescan",
+        dest="prescan",
+        help="always parse, even if a quick scan finds nothing to rewrite",
+        action="store_false",
+    )
+    parser.add_argument(
+        "--check",
+        help="don't write anything, exit 1 and list inputs whose output needs regeneration",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="write output of a single input to this file instead of stdout",
+        default=None,
+    )
+    parser.add_argument(
+        "--output-dir",
+        dest="output_dir",
+        help="batch mode: write output of each input (or input dir) to this dir",
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of worker processes in batch mode",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--threads",
+        help="batch mode: run the workers as threads of this process instead of separate processes",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--literals-only",
+        dest="literals_only",
+        help="only rewrite string literals, found with a built-in lexer instead of a libclang parse",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--enum-format",
+        dest="enum_format",
+        help="generate enum format_as as a switch (default), or as a lookup table: an array indexed by value "
+        "when values are dense, else a sorted table searched by value",
+        choices=["switch", "table"],
+        default="switch",
+    )
+    parser.add_argument(
+        "--enum-from-string",
+        dest="enum_from_string",
+        help="also generate from_string(name, enum&) for enums, looking names up in a perfect hash",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--to-string-style",
+        dest="to_string_style",
+        help="format string of generated to_string(): a runtime std::string (default), FMT_STRING checked at "
+        "build time, or FMT_COMPILE checked and parsed at build time",
+        choices=["runtime", "checked", "compiled"],
+        default="runtime",
+    )
+    parser.add_argument(
+        "--format-to",
+        dest="format_to",
+        help="generate a format_to(OutputIt) member that writes into the caller's buffer, with to_string() "
+        "as a wrapper around it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fstring-style",
+        dest="fstring_style",
+        help="format string of rewritten literals: runtime (default), FMT_STRING checked at build time, or "
+        "FMT_COMPILE checked and parsed at build time; literals that can't be are left runtime",
+        choices=["runtime", "checked", "compiled"],
+        default="runtime",
+    )
+    parser.add_argument(
+        "--print-to-stream",
+        dest="print_to_stream",
+        help='rewrite literals streamed into an ostream, eg std::cout << "{x}", to fmt::print(std::cout, ...) '
+        "instead of streaming a temporary string (needs the libclang parse)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--log-call",
+        dest="log_calls",
+        metavar="NAME",
+        help="logging macro or function that takes a format string and args, eg spdlog::debug: a literal that "
+        "is its only argument is passed on as format string and args, to only be formatted when the level is "
+        "enabled (can be repeated, needs the libclang parse)",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--inherited-fields",
+        dest="inherited_fields",
+        help="print fields of base classes by copying them into to_string() of every derived class (default), "
+        "or by delegating to the to_string() of the base, which keeps generated code linear in hierarchy size",
+        choices=["flatten", "delegate"],
+        default="flatten",
+    )
+    parser.add_argument(
+        "--max-elements",
+        dest="max_elements",
+        metavar="N",
+        help="print at most N elements of container and array fields in generated to_string(), followed by "
+        "...(M more)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--max-elements-for",
+        dest="max_elements_for",
+        metavar="PATTERN=N",
+        help="limit for fields whose name, Class::name or type matches the glob PATTERN, instead of "
+        "--max-elements; a negative N means no limit (can be repeated)",
+        type=get_pattern_limit,
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--time-budget",
+        dest="time_budget",
+        metavar="SECONDS",
+        help="parse each file in a child process that is stopped after SECONDS",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--memory-budget",
+        dest="memory_budget",
+        metavar="MB",
+        help="parse each file in a child process that is stopped once its RSS goes over MB",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--over-budget",
+        dest="over_budget",
+        help="what to do with files over their time or memory budget: only rewrite string literals (default) "
+        "or pass them through unchanged",
+        choices=["literals", "passthrough"],
+        default="literals",
+    )
+    parser.add_argument(
+        "--edit-headers",
+        dest="edit_headers",
+        metavar="GLOB",
+        help="batch mode: also apply edits to included headers matching GLOB, writing each one once next to the "
+        "output of the first file that includes it (can be repeated)",
+        action="append",
+    )
+    parser.add_argument(
+        "--changed",
+        metavar="FILE",
+        help="batch mode: only process inputs that are or include FILE, using the include index in --cache-dir "
+        "(can be repeated)",
+        action="append",
+    )
+    parser.add_argument(
+        "--list-affected",
+        dest="list_affected",
+        help="print the inputs affected by --changed files and exit",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        metavar="PATH",
+        help="write metrics of the run to PATH in prometheus textfile format",
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-json",
+        dest="metrics_json",
+        metavar="PATH",
+        help="append metrics of the run to PATH as one json line",
+        default=None,
+    )
+    parser.add_argument(
+        "--size-report",
+        dest="size_report",
+        metavar="PATH",
+        help="write the size of generated code per class or enum, file and namespace to PATH (json if it ends "
+        "in .json); files are regenerated instead of read from the output cache",
+        default=None,
+    )
+    parser.add_argument(
+        "--binary-schema",
+        dest="binary_schema",
+        metavar="PATH",
+        help="also generate encode() members that write fields as binary, and write the schema to decode them "
+        "with cpp-fstring-decode to PATH; files are regenerated instead of read from the output cache",
+        default=None,
+    )
+    parser.add_argument(
+        "--emit",
+        help="write the whole modified file (default), only the edits as json or clang-apply-replacements yaml, "
+        "or a unified diff",
+        choices=["code", "json", "yaml", "diff"],
+        default="code",
+    )
+    parser.add_argument(
+        "filenames",
+        metavar="filename",
+        nargs="+",
+        help="name of files or dirs to process",
     )
 
     return parser.parse_known_args(args)
@@ -79,6 +323,507 @@ def setup_logging(loglevel):
     logging.basicConfig(level=loglevel, stream=sys.stderr, format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
 
 
+def setup_output():
+    """
+    generated code is always utf-8
+    """
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(encoding="utf-8")
+
+
+def get_output_options(args):
+    return [f"--{name}={getattr(args, name)}" for name in OUTPUT_OPTIONS]
+
+
+@contextmanager
+def map_file(filename):
+    """
+    memory-map filename read-only. Empty files can't be mapped, so they give b""
+    """
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def get_parsable(filename, data):
+    """
+    clang token spellings are decoded as utf-8, so files that aren't valid utf-8
+    lose their invalid bytes before parsing, like they always did
+    """
+    try:
+        str(data, "utf8")
+    except UnicodeDecodeError:
+        log.warning(f"{filename} is not valid utf-8, dropping invalid bytes")
+        return str(data, "utf8", errors="ignore").encode("utf8")
+    return data
+
+
+def same_bytes(a, b):
+    """
+    compare bytes-like objects (mmap has no == of its own)
+    """
+    with memoryview(a) as view_a, memoryview(b) as view_b:
+        return view_a == view_b
+
+
+def write_stdout(output):
+    sys.stdout.flush()
+    if hasattr(sys.stdout, "buffer"):
+        sys.stdout.buffer.write(output)
+        sys.stdout.buffer.flush()
+    else:
+        sys.stdout.write(output.decode("utf8", errors="surrogateescape"))
+
+
+def process_file(filename, args, extraargs, stats, expect=None):
+    """
+    run all 3 phases on one file and return the modified code as bytes
+
+    if expect is given, phase 3 only compares against it and returns True on a match.
+    """
+    with map_file(filename) as data:
+        return process_data(filename, data, args, extraargs, stats, expect)
+
+
+def process_data(filename, data, args, extraargs, stats, expect=None, headers=None, mode=None):
+    """
+    files that provably have nothing to rewrite skip the libclang parse,
+    but still go through phase 2 and 3 so output is identical to a full run.
+
+    data is handed to libclang as is and edits are applied at the byte offsets
+    clang reports, so code is never decoded.
+
+    with --edit-headers, allow-listed headers are rendered into the headers dict
+    as {header: output} instead, each only once per process. Their output isn't
+    cached and the prescan is off, as both only look at the main file.
+
+    mode is None for a normal run, "parse" inside a budget child process, or the
+    --over-budget fallback ("literals" or "passthrough") once a file went over.
+    """
+    if mode is None and (args.time_budget or args.memory_budget) and not args.literals_only:
+        return process_data_with_budget(filename, data, args, extraargs, stats, expect, headers)
+    is_fallback = mode in ("literals", "passthrough")
+    stats["files"] += 1
+    stats["bytes_in"] += len(data)
+
+    from cpp_fstring.Cache import Cache
+
+    cache = Cache(args.cache_dir)
+    # fallback output isn't what the options ask for, so it is never cached
+    use_output_cache = (
+        args.cache_dir and not args.edit_headers and not is_fallback and not args.size_report and not args.binary_schema
+    )
+    if use_output_cache:
+        key = cache.get_key(filename, data, extraargs, __version__, get_output_options(args))
+        output = cache.get_output(key)
+        if output is not None:
+            log.info(f"cache hit for {filename}")
+            stats["cache_hits"] += 1
+            if expect is not None:
+                return same_bytes(output, expect)
+            stats["bytes_out"] += len(output)
+            return output
+
+    from cpp_fstring.GenerateOutput import GenerateOutput
+    from cpp_fstring.Metrics import observe
+    from cpp_fstring.Prescan import Prescan
+    from cpp_fstring.Processor import Processor
+
+    dependencies = [filename]
+    parser = None
+    if mode == "passthrough":
+        string_records, enum_records, class_records = [], [], []
+    elif args.prescan and not args.edit_headers and not Prescan().needs_parse(data):
+        log.info(f"nothing to rewrite in {filename}, skipping parse")
+        stats["parse_skipped"] += 1
+        string_records, enum_records, class_records = [], [], []
+    elif args.literals_only or mode == "literals":
+        from cpp_fstring.Lexer import Lexer
+
+        data = get_parsable(filename, data)
+        start = time.perf_counter()
+        string_records, enum_records, class_records = Lexer().extract_string_records(data), [], []
+        observe(stats, "extract", time.perf_counter() - start)
+    else:
+        from cpp_fstring.ParseCPP import ParseCPP
+
+        # record all interesting snippets in source
+        data = get_parsable(filename, data)
+        parser = ParseCPP(
+            data,
+            filename,
+            extraargs,
+            cache=cache,
+            edit_headers=args.edit_headers,
+            print_to_stream=args.print_to_stream,
+            log_calls=args.log_calls,
+            delegate_bases=args.inherited_fields == "delegate",
+        )
+        string_records, enum_records, class_records = parser.extract_interesting_records()
+        dependencies.extend(parser.dependencies)
+        stats["duplicates_avoided"] += parser.duplicates
+        observe(stats, "parse", parser.parse_seconds)
+        observe(stats, "extract", parser.extract_seconds)
+    if args.cache_dir and not is_fallback:
+        cache.set_includes(filename, dependencies[1:])
+
+    # batch up changes and additions:
+    #   changes: in line edits to existing code
+    #   addition: can be appended to the end of file
+    start = time.perf_counter()
+    processor = Processor(args)
+    # changes
+    string_changes = processor.gen_fstring_changes(string_records)
+    class_changes = processor.gen_class_changes(class_records)
+    enum_changes = processor.gen_enum_changes(enum_records)
+    if args.edit_headers and parser is not None:
+        string_changes, class_changes, enum_changes, enum_records = render_headers(
+            parser, processor, headers, stats, string_changes, class_changes, enum_changes, enum_records
+        )
+    # addition
+    enum_addition = processor.gen_enum_format(enum_records)
+    # class_addition = processor.gen_class_format(class_records)
+    if args.size_report:
+        record_artifacts(filename, parser, processor, args, stats)
+    if args.binary_schema:
+        from cpp_fstring.BinarySchema import record_schema
+
+        record_schema(stats, processor.schema)
+
+    # execute changes
+    out = io.BytesIO()
+    go = GenerateOutput(data, out=out)
+    if args.emit == "code":
+        if expect is not None:
+            edits = go.get_edits(string_changes, class_changes, enum_changes)
+            return go.matches(expect, edits, [enum_addition])
+        go.write_changes(string_changes, class_changes, enum_changes)
+        go.append(enum_addition)
+        # go.append(class_addition)
+    else:
+        # only the edits: output size follows the size of the change, not of the file
+        edits = go.get_edits(string_changes, class_changes, enum_changes)
+        write_edits = {"json": go.write_edits_json, "yaml": go.write_edits_yaml, "diff": go.write_diff}
+        write_edits[args.emit](filename, edits, [enum_addition])
+    output = out.getvalue()
+    observe(stats, "generate", time.perf_counter() - start)
+    if expect is not None:
+        return same_bytes(output, expect)
+
+    stats["bytes_out"] += len(output)
+    if use_output_cache:
+        cache.set_output(key, output, dependencies)
+
+    return output
+
+
+def get_rss(pid):
+    """
+    resident set size of pid in bytes, or None where /proc isn't available
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_budget_context():
+    """
+    multiprocessing context for budget children
+
+    fork is cheapest, but only safe while this is the only thread: with --threads a
+    fork could copy a lock, eg of libclang, held by another thread and the child would
+    hang on it. Then children start from a forkserver, or spawn where there is none.
+    """
+    import multiprocessing
+    import threading
+
+    methods = multiprocessing.get_all_start_methods()
+    if "fork" in methods and threading.active_count() == 1:
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def run_budget_child(sender, filename, data, args, extraargs, expect, with_headers, symbol_state):
+    """
+    body of a budget child: get ready, report its RSS, then parse and send the results back
+
+    the ready message starts the time budget, and its RSS is the baseline of the memory
+    budget, as a forked child starts out with all the memory of its parent. Imports and
+    loading libclang, which a spawned child does itself, come before it so they don't
+    count. Symbols the child sees go back to the parent too.
+    """
+    from cpp_fstring.Cache import Cache
+    from cpp_fstring.GenerateOutput import GenerateOutput  # noqa: F401
+    from cpp_fstring.ParseCPP import ParseCPP
+    from cpp_fstring.Processor import Processor  # noqa: F401
+    from cpp_fstring.SymbolTable import symbols
+
+    ParseCPP(b"", filename, extraargs, cache=Cache(args.cache_dir)).load_libclang()
+    symbols.merge(symbol_state)
+    sender.send(get_rss(os.getpid()) or 0)
+    child_stats, child_headers = Counter(), {} if with_headers else None
+    try:
+        result = process_data(filename, data, args, extraargs, child_stats, expect, child_headers, mode="parse")
+        sender.send([result, child_stats, child_headers, symbols.get_state()])
+    except Exception as e:
+        sender.send(e)
+
+
+def process_data_with_budget(filename, data, args, extraargs, stats, expect=None, headers=None):
+    """
+    run process_data in a child process, since a libclang parse can't be interrupted in process.
+
+    the child is killed once it runs longer than --time-budget or its RSS grows by more
+    than --memory-budget, and the file is redone with the --over-budget fallback, which
+    needs no parse. The memory budget needs /proc, ie linux.
+    """
+    from cpp_fstring.SymbolTable import symbols
+
+    ctx = get_budget_context()
+    if ctx.get_start_method() == "fork":
+        from cpp_fstring.Cache import Cache
+        from cpp_fstring.ParseCPP import ParseCPP
+
+        # load libclang once here instead of in every child
+        ParseCPP(b"", filename, extraargs, cache=Cache(args.cache_dir)).load_libclang()
+    else:
+        # inputs are pickled to the child, and mmaps can't be
+        data = bytes(data)
+        expect = bytes(expect) if expect is not None else None
+
+    receiver, sender = ctx.Pipe(duplex=False)
+    child_args = [sender, filename, data, args, extraargs, expect, headers is not None, symbols.get_state()]
+    proc = ctx.Process(target=run_budget_child, args=child_args)
+    proc.start()
+    sender.close()
+    deadline = None
+    baseline = None
+    reason = None
+    try:
+        # budgets start once the child is ready, and are checked before each wait, so even
+        # a fast child is measured once
+        while True:
+            if deadline is not None and time.monotonic() > deadline:
+                reason = f"took over {args.time_budget}s"
+                break
+            rss = get_rss(proc.pid) if args.memory_budget and baseline is not None else None
+            if rss is not None and rss - baseline > args.memory_budget * 2**20:
+                reason = f"grew by over {args.memory_budget}MB"
+                break
+            if receiver.poll(0.02):
+                try:
+                    reply = receiver.recv()
+                except EOFError:
+                    reason = "stopped"
+                    break
+                if baseline is None:
+                    baseline = reply
+                    deadline = time.monotonic() + args.time_budget if args.time_budget else None
+                    continue
+                break
+    finally:
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        receiver.close()
+    if reason == "stopped":
+        reason = f"stopped with exit code {proc.exitcode}"
+
+    if reason is None:
+        if isinstance(reply, Exception):
+            raise reply
+        result, child_stats, child_headers, symbol_state = reply
+        stats.update(child_stats)
+        symbols.merge(symbol_state)
+        if headers is not None:
+            headers.update(child_headers)
+        return result
+
+    log.warning(f"{filename} {reason}, falling back to {args.over_budget}")
+    stats["over_budget"] += 1
+    # like artifacts, the file is a counter key, so it survives merging stats of workers
+    stats[("over_budget_file", filename)] += 1
+    return process_data(filename, data, args, extraargs, stats, expect, headers, mode=args.over_budget)
+
+
+def get_over_budget_files(stats):
+    """
+    files of stats that fell back to --over-budget, in the order their stats were added
+    """
+    return [key[1] for key in stats if isinstance(key, tuple) and key[0] == "over_budget_file"]
+
+
+def record_artifacts(filename, parser, processor, args, stats):
+    """
+    add the generated code of processor to stats, under the file it ends up in
+    """
+    from cpp_fstring.SizeReport import record_artifact
+
+    for kind, name, namespace, code, tok, is_appended in processor.artifacts:
+        file = tok.location.file.name
+        # appended code goes to the end of the output, unless the record's header is rendered itself
+        if is_appended and file != filename and not (args.edit_headers and parser.is_editable(file)):
+            file = filename
+        record_artifact(stats, file, tok.location.offset, kind, name, namespace, code)
+
+
+def render_headers(parser, processor, headers, stats, *changes_and_enums):
+    """
+    move changes and enums located in allow-listed headers out of the main file lists
+    and render each header with its own edits, unless it was rendered before.
+
+    returns string, class and enum changes and enum records left for the main file
+    """
+    from cpp_fstring.GenerateOutput import GenerateOutput
+
+    def get_file(item):
+        # changes are [token, replacement], enums are records
+        tok = item[0] if isinstance(item, list) else item.last_tok
+        return tok.location.file.name
+
+    in_main = []
+    in_headers = {}
+    for items in changes_and_enums:
+        in_main.append([])
+        for item in items:
+            file = get_file(item)
+            if file == parser.filename or not parser.is_editable(file):
+                in_main[-1].append(item)
+            else:
+                in_headers.setdefault(file, [[] for _ in changes_and_enums])[len(in_main) - 1].append(item)
+
+    for file, [*changes, enum_records] in in_headers.items():
+        if headers is None or not parser.symbols.add_file(os.path.realpath(file)):
+            continue
+        log.info(f"rendering edits to included {file}")
+        stats["headers"] += 1
+        out = io.BytesIO()
+        with map_file(file) as code:
+            go = GenerateOutput(code, out=out)
+            go.write_changes(*changes)
+            go.append(processor.gen_enum_format(enum_records))
+        headers[file] = out.getvalue()
+
+    return in_main
+
+
+def check_data(filename, data, expect, output_path, args, extraargs):
+    """
+    is expect (or if None, the cache) up to date with input data?
+
+    nothing is written. Without expected output the answer comes from the cache alone,
+    so a miss counts as stale without parsing anything. With --edit-headers the headers
+    rendered along with the file are checked against their outputs next to output_path.
+    """
+    stats = Counter()
+    if expect is None:
+        from cpp_fstring.Cache import Cache
+
+        stats["files"] += 1
+        cache = Cache(args.cache_dir)
+        key = cache.get_key(filename, data, extraargs, __version__, get_output_options(args))
+        is_current = cache.get_output(key) is not None
+        stats["cache_hits"] += is_current
+        return is_current, stats
+
+    headers = {} if args.edit_headers else None
+    is_current = process_data(filename, data, args, extraargs, stats, expect=expect, headers=headers)
+    for header, header_output in (headers or {}).items():
+        header_path = get_header_output_path(header, filename, output_path, args.output_dir)
+        if header_path is None:
+            continue
+        if not os.path.isfile(header_path):
+            log.info(f"{header_path} of {header} is missing")
+            is_current = False
+            continue
+        with map_file(header_path) as current:
+            if not same_bytes(header_output, current):
+                log.info(f"{header_path} of {header} is stale")
+                is_current = False
+    return is_current, stats
+
+
+def check_file(filename, output_path, args, extraargs):
+    """
+    check filename against output_path, or against the cache if output_path is None
+    """
+    if output_path is not None and not os.path.isfile(output_path):
+        return False, Counter()
+    with map_file(filename) as data:
+        if output_path is None:
+            return check_data(filename, data, None, None, args, extraargs)
+        with map_file(output_path) as expect:
+            return check_data(filename, data, expect, output_path, args, extraargs)
+
+
+def generate_data(filename, data, args, extraargs):
+    """
+    process input already read into memory, eg by the batch pipeline
+
+    returns [output, {header: output}] and stats
+    """
+    stats = Counter()
+    headers = {}
+    output = process_data(filename, data, args, extraargs, stats, headers=headers)
+    return [output, headers], stats
+
+
+def get_header_output_path(header, filename, output_path, output_dir):
+    """
+    headers keep their location relative to the file that includes them,
+    as long as that stays inside output_dir. Returns None otherwise
+    """
+    relpath = os.path.relpath(os.path.realpath(header), os.path.dirname(os.path.realpath(filename)))
+    path = os.path.normpath(os.path.join(os.path.dirname(output_path), relpath))
+    if os.path.relpath(path, output_dir).startswith(os.pardir):
+        return None
+    return path
+
+
+def write_outputs(filename, output_path, outputs, stats, output_dir):
+    """
+    write output of filename and of any headers rendered along with it
+    """
+    output, headers = outputs
+    write_output(output_path, output, stats)
+    for header, header_output in headers.items():
+        header_path = get_header_output_path(header, filename, output_path, output_dir)
+        if header_path is None:
+            log.warning(f"not writing {header}: it would end up outside {output_dir}")
+            continue
+        write_output(header_path, header_output, stats)
+
+
+def write_output(output_path, output, stats):
+    """
+    only touch output_path if its contents change, so build tools don't see a new mtime
+    """
+    if os.path.isfile(output_path):
+        with map_file(output_path) as current:
+            is_unchanged = same_bytes(output, current)
+        if is_unchanged:
+            stats["unchanged"] += 1
+            return
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(output)
+
+
+def write_file(filename, output_path, args, extraargs):
+    """
+    process filename into output_path
+    """
+    with map_file(filename) as data:
+        outputs, stats = generate_data(filename, data, args, extraargs)
+    write_outputs(filename, output_path, outputs, stats, args.output_dir or os.path.dirname(output_path))
+    return True, stats
+
+
 def main(args):
     """
     main entry point for cpp-fstring.
@@ -94,42 +839,90 @@ def main(args):
         - execute these changes in the input file and write modified code to stdout
 
     """
+    start = time.perf_counter()
     args, extraargs = parse_args(args)
     setup_logging(args.loglevel)
+    setup_output()
     log.debug(f"args = {args}")
 
-    with open(args.filename, encoding="utf8", errors="ignore") as f:
-        code = f.read()
+    is_batch = args.output_dir is not None or len(args.filenames) > 1 or os.path.isdir(args.filenames[0])
+    is_batch = is_batch or bool(args.changed or args.edit_headers)
+    if is_batch:
+        from cpp_fstring.Batch import Batch
 
-    # record all interesting snippets in source
-    parser = ParseCPP(code, args.filename, extraargs)
-    string_records, enum_records, class_records = parser.extract_interesting_records()
+        if args.output:
+            log.error("use --output-dir instead of --output with more than one input or --changed")
+            return 2
+        if args.changed and args.cache_dir is None:
+            log.error("--changed needs --cache-dir to find the include index")
+            return 2
+        if args.list_affected:
+            if not args.changed:
+                log.error("--list-affected needs --changed")
+                return 2
+            batch = Batch(args, extraargs)
+            for filename, _ in batch.get_affected_jobs(batch.get_jobs(args.filenames)):
+                print(filename)
+            return 0
+        if args.edit_headers and args.output_dir is None:
+            log.error("--edit-headers needs --output-dir to write the headers to")
+            return 2
+        if args.output_dir is None and not (args.check and args.cache_dir):
+            log.error("batch mode needs --output-dir (or --check with --cache-dir)")
+            return 2
+        batch = Batch(args, extraargs)
+        failed = batch.run(args.filenames)
+        stats = batch.stats
+    elif args.check:
+        if args.output is None and args.cache_dir is None:
+            log.error("--check needs --output or --cache-dir to compare against")
+            return 2
+        is_current, stats = check_file(args.filenames[0], args.output, args, extraargs)
+        failed = [] if is_current else args.filenames
+    elif args.output:
+        _, stats = write_file(args.filenames[0], args.output, args, extraargs)
+        failed = []
+    else:
+        stats = Counter()
+        output = process_file(args.filenames[0], args, extraargs, stats)
+        write_stdout(output)
+        failed = []
 
-    # batch up changes and additions:
-    #   changes: in line edits to existing code
-    #   addition: can be appended to the end of file
-    processor = Processor()
-    # changes
-    string_changes = processor.gen_fstring_changes(string_records)
-    class_changes = processor.gen_class_changes(class_records)
-    enum_changes = processor.gen_enum_changes(enum_records)
-    # addition
-    enum_addition = processor.gen_enum_format(enum_records)
-    # class_addition = processor.gen_class_format(class_records)
+    if args.check:
+        for filename in failed:
+            print(filename)
+    over_budget = get_over_budget_files(stats)
+    if over_budget:
+        log.warning(f"{len(over_budget)} files over budget, fell back to {args.over_budget}: {' '.join(over_budget)}")
 
-    # execute changes
-    go = GenerateOutput(code)
-    go.write_changes(string_changes, class_changes, enum_changes)
-    go.append(enum_addition)
-    # go.append(class_addition)
+    log.info(
+        f"files={stats['files']} parse_skipped={stats['parse_skipped']} cache_hits={stats['cache_hits']} "
+        f"duplicates_avoided={stats['duplicates_avoided']}"
+    )
+    if args.metrics_file or args.metrics_json:
+        from cpp_fstring.Metrics import Metrics
+
+        metrics = Metrics(stats, time.perf_counter() - start)
+        if args.metrics_file:
+            metrics.write_prometheus(args.metrics_file)
+        if args.metrics_json:
+            metrics.append_json(args.metrics_json)
+    if args.size_report:
+        from cpp_fstring.SizeReport import SizeReport
+
+        SizeReport(stats).write(args.size_report)
+    if args.binary_schema:
+        from cpp_fstring.BinarySchema import BinarySchema
 
+        BinarySchema(stats).write(args.binary_schema)
     log.info("end")
+    return 1 if failed else 0
 
 
 def run():
     # entry point to create console scripts with setuptools.
-    main(sys.argv[1:])
+    return main(sys.argv[1:])
 
 
 if __name__ == "__main__":
-    run()
+    sys.exit(run())
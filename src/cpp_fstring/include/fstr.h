@@ -56,11 +56,16 @@
 
 #pragma once
 
+#include <algorithm>
+#include <cstdint>
+#include <cstring>
+#include <iterator>
 #include <string>
 #include <type_traits>
 #include <typeinfo>
 #include <cxxabi.h>
 
+#include <fmt/compile.h>
 #include <fmt/ranges.h>
 #include <fmt/std.h>
 #include <fmt/xchar.h>
@@ -97,6 +102,22 @@ std::string get_type_name() {
 
 
 
+// 32 bit FNV-1a with seed mixed into the offset basis and a final mix, used by generated from_string()
+// lookups. Must match perfect_hash() in PerfectHash.py
+constexpr std::uint32_t perfect_hash(fmt::string_view name, std::uint32_t seed) {
+  std::uint32_t hash = 0x811c9dc5u ^ seed;
+  for (char c : name) {
+    hash = (hash ^ static_cast<unsigned char>(c)) * 0x01000193u;
+  }
+  // murmur3 finalizer, so the low bits used for small tables depend on all of them
+  hash ^= hash >> 16;
+  hash *= 0x85ebca6bu;
+  hash ^= hash >> 13;
+  hash *= 0xc2b2ae35u;
+  hash ^= hash >> 16;
+  return hash;
+}
+
 // Helper function to check if a type has a to_string member function
 template <typename T>
 constexpr auto has_to_string(int)
@@ -105,17 +126,30 @@ constexpr auto has_to_string(int)
 template <typename T>
 constexpr auto has_to_string(...) -> std::false_type;
 
+// Helper function to check if a type has a format_to(OutputIt) member function
+template <typename T, typename OutputIt>
+constexpr auto has_format_to(int)
+    -> decltype(std::declval<const T&>().format_to(std::declval<OutputIt>()), std::true_type{});
+
+template <typename T, typename OutputIt>
+constexpr auto has_format_to(...) -> std::false_type;
+
 } // namespace fstr
 
-// Custom formatter for classes and structs with a to_string member function
+// Custom formatter for classes and structs with a to_string (and maybe a format_to) member function
 template <typename T>
 struct fmt::formatter<T, char, std::enable_if_t<decltype(fstr::has_to_string<T>(0))::value>> {
     constexpr auto parse(format_parse_context& ctx) { return ctx.begin(); }
 
     template <typename FormatContext>
     auto format(const T& obj, FormatContext& ctx) const {
-        // Call the to_string function and format the resulting string
-        return fmt::format_to(ctx.out(), "{}", obj.to_string());
+        if constexpr (decltype(fstr::has_format_to<T, decltype(ctx.out())>(0))::value) {
+            // write straight into the output, without a temporary string
+            return obj.format_to(ctx.out());
+        } else {
+            // Call the to_string function and format the resulting string
+            return fmt::format_to(ctx.out(), "{}", obj.to_string());
+        }
     }
 };
 
@@ -132,6 +166,64 @@ auto safe_format(const T& value) -> std::string {
   }
 }
 
+// stand-in for un-formattable args of compile-time checked format strings
+struct unknown {};
+
+// pass param through if it's formattable, else an unknown that formats as <unknown>.
+// Unlike safe_format nothing is converted to a string, so format specs still apply
+template <typename T>
+constexpr decltype(auto) safe_arg(const T& value) {
+  if constexpr (fmt::is_formattable<T>::value) {
+    return value;
+  } else {
+    return unknown{};
+  }
+}
+
+// a range with at most limit of its elements printed, made by bound()
+template <typename R>
+struct bounded {
+  const R& range;
+  std::size_t limit;
+};
+
+// pass param through, unless it's a range (but not a string) that should print at most limit elements.
+// generated to_string() wraps fields in bound() with --max-elements
+template <typename T>
+constexpr decltype(auto) bound(const T& value, std::size_t limit) {
+  if constexpr (fmt::is_range<T, char>::value && !std::is_convertible_v<const T&, fmt::string_view>) {
+    return bounded<T>{value, limit};
+  } else {
+    return value;
+  }
+}
+
+template <typename R, typename = void>
+struct key_type_of {};
+
+template <typename R>
+struct key_type_of<R, std::void_t<typename R::key_type>> {
+  using key_type = typename R::key_type;
+};
+
+template <typename R, typename = void>
+struct mapped_type_of {};
+
+template <typename R>
+struct mapped_type_of<R, std::void_t<typename R::mapped_type>> {
+  using mapped_type = typename R::mapped_type;
+};
+
+// first elements of a range, with its key and mapped types so fmt prints maps and sets the same way
+template <typename R>
+struct head : key_type_of<R>, mapped_type_of<R> {
+  using iterator = decltype(std::begin(std::declval<const R&>()));
+  iterator first;
+  iterator last;
+  iterator begin() const { return first; }
+  iterator end() const { return last; }
+};
+
 // Inspect all format args for fmt:: formattability
 // TODO(deep): deal with unformattable entries with format spec expecting integers or floats
 template <typename... Args>
@@ -139,4 +231,111 @@ std::string format(const std::string& fmt_string, const Args&... args) {
   return fmt::format(fmt_string, safe_format(args)...);
 }
 
+// Binary encoding used by the encode() members generated with --binary-schema, decoded offline
+// by cpp_fstring.Decoder. A record is its 4 byte type id followed by its fields, each a one byte
+// code, like the ones of python's struct module, and the raw value:
+//   ? bool, c char, b B h H i I q Q integers, f float, d double, P pointer as 8 bytes,
+//   e enum followed by its underlying integer, s string as 4 byte length and bytes,
+//   r nested record
+// Anything else is formatted here and written as a string. Values are written in host byte
+// order, and decoded as little-endian.
+template <typename Buffer>
+void write_bytes(Buffer& out, const void* data, std::size_t size) {
+  const char* bytes = static_cast<const char*>(data);
+  out.append(bytes, bytes + size);
+}
+
+template <typename Buffer, typename T>
+void write_value(Buffer& out, char code, const T& value) {
+  out.append(&code, &code + 1);
+  write_bytes(out, &value, sizeof(value));
+}
+
+template <typename Buffer>
+void encode_id(Buffer& out, std::uint32_t id) {
+  write_bytes(out, &id, sizeof(id));
+}
+
+template <typename T>
+constexpr auto has_encode(int)
+    -> decltype(std::declval<const T&>().encode(std::declval<std::string&>()), std::true_type{});
+
+template <typename T>
+constexpr auto has_encode(...) -> std::false_type;
+
+template <typename T>
+constexpr bool is_char_type_v = std::is_same_v<T, wchar_t> || std::is_same_v<T, char16_t> ||
+                                std::is_same_v<T, char32_t>;
+
+template <typename T>
+constexpr char get_int_code() {
+  constexpr const char* codes = "bBhHiIqQ";
+  constexpr int size = sizeof(T) == 1 ? 0 : sizeof(T) == 2 ? 2 : sizeof(T) == 4 ? 4 : 6;
+  return codes[size + (std::is_unsigned_v<T> ? 1 : 0)];
+}
+
+template <typename Buffer, typename T>
+void encode(Buffer& out, const T& value) {
+  if constexpr (std::is_same_v<T, bool>) {
+    write_value(out, '?', static_cast<std::uint8_t>(value));
+  } else if constexpr (std::is_same_v<T, char>) {
+    write_value(out, 'c', value);
+  } else if constexpr (std::is_integral_v<T> && !is_char_type_v<T> && sizeof(T) <= 8) {
+    write_value(out, get_int_code<T>(), value);
+  } else if constexpr (std::is_same_v<T, float>) {
+    write_value(out, 'f', value);
+  } else if constexpr (std::is_same_v<T, double>) {
+    write_value(out, 'd', value);
+  } else if constexpr (std::is_enum_v<T>) {
+    const char code = 'e';
+    out.append(&code, &code + 1);
+    encode(out, static_cast<std::underlying_type_t<T>>(value));
+  } else if constexpr (std::is_pointer_v<T> && !std::is_convertible_v<T, fmt::string_view>) {
+    write_value(out, 'P', static_cast<std::uint64_t>(reinterpret_cast<std::uintptr_t>(value)));
+  } else if constexpr (std::is_convertible_v<const T&, fmt::string_view>) {
+    fmt::string_view text = value;
+    write_value(out, 's', static_cast<std::uint32_t>(text.size()));
+    write_bytes(out, text.data(), text.size());
+  } else if constexpr (decltype(has_encode<T>(0))::value) {
+    const char code = 'r';
+    out.append(&code, &code + 1);
+    value.encode(out);
+  } else {
+    encode(out, safe_format(value));
+  }
+}
+
 } // namespace fstr
+
+template <>
+struct fmt::formatter<fstr::unknown> : formatter<string_view> {
+  template <typename FormatContext>
+  auto format(fstr::unknown, FormatContext& ctx) const {
+    return formatter<string_view>::format("<unknown>", ctx);
+  }
+};
+
+// print the first elements of a range like fmt does, followed by ...(N more)
+template <typename R>
+struct fmt::formatter<fstr::bounded<R>> {
+  constexpr auto parse(format_parse_context& ctx) { return ctx.begin(); }
+
+  template <typename FormatContext>
+  auto format(const fstr::bounded<R>& obj, FormatContext& ctx) const {
+    if constexpr (!fmt::is_formattable<R>::value) {
+      return fmt::format_to(ctx.out(), "<unknown>");
+    } else {
+      auto first = std::begin(obj.range);
+      auto size = static_cast<std::size_t>(std::distance(first, std::end(obj.range)));
+      if (size <= obj.limit) {
+        return fmt::format_to(ctx.out(), "{}", obj.range);
+      }
+      fmt::memory_buffer buf;
+      fmt::format_to(fmt::appender(buf), "{}", fstr::head<R>{{}, {}, first, std::next(first, obj.limit)});
+      // everything but the closing bracket, which goes after the marker
+      auto out = std::copy(buf.begin(), buf.end() - 1, ctx.out());
+      out = fmt::format_to(out, "{}...({} more)", obj.limit ? ", " : "", size - obj.limit);
+      return std::copy(buf.end() - 1, buf.end(), out);
+    }
+  }
+};
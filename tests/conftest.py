@@ -2,5 +2,43 @@
     Dummy conftest.py for cpp_fstring.
 
 """
+import os
+import shutil
+import subprocess
 
-# import pytest
+import pytest
+
+include_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "cpp_fstring", "include")
+
+
+@pytest.fixture
+def build_and_run(tmp_path):
+    """
+    build generated code with g++ and fmt and return what it prints; warnings fail the build,
+    and tests skip where g++ or fmt is missing
+    """
+    compiler = shutil.which("g++")
+    if compiler is None:
+        pytest.skip("needs g++")
+    probe = subprocess.run([compiler, "-x", "c++", "-E", "-"], input=b"#include <fmt/format.h>", capture_output=True)
+    if probe.returncode != 0:
+        pytest.skip("needs fmt headers")
+
+    def run(source_file):
+        exe_file = str(tmp_path / "a.out")
+        build = [
+            compiler,
+            "-std=c++17",
+            "-Wall",
+            "-Werror",
+            "-DFMT_HEADER_ONLY",
+            "-I",
+            include_dir,
+            str(source_file),
+            "-o",
+            exe_file,
+        ]
+        subprocess.run(build, check=True)
+        return subprocess.run([exe_file], capture_output=True, check=True).stdout
+
+    return run
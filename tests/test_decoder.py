@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import json
+import struct
+
+import pytest
+
+from cpp_fstring.cpp_fstring import main
+from cpp_fstring.Decoder import Decoder, format_float
+from cpp_fstring.PerfectHash import perfect_hash
+
+
+@pytest.mark.parametrize(
+    "value, size, expect",
+    [
+        (1.0, 8, "1"),
+        (0.1, 8, "0.1"),
+        (1e20, 8, "1e+20"),
+        (-2.5e-7, 8, "-2.5e-07"),
+        (struct.unpack("<f", struct.pack("<f", 0.1))[0], 4, "0.1"),
+        (float("inf"), 8, "inf"),
+    ],
+)
+def test_format_float(value, size, expect):
+    """
+    floats are written like fmt's "{}"
+    """
+    assert format_float(value, size) == expect
+
+
+def test_decode(tmp_path):
+    """
+    bytes laid out like fstr::encode writes them decode to the text of to_string()
+    """
+    input_file = tmp_path / "encode.cpp"
+    input_file.write_text(
+        """
+namespace ns { enum class Color { red, green = 5 }; }
+struct Inner { short k; };
+struct Outer {
+  bool flag;
+  double d;
+  const char* name;
+  ns::Color c;
+  Inner inner;
+};
+"""
+    )
+    schema_file = tmp_path / "schema.json"
+    main(["--binary-schema", str(schema_file), "-o", str(tmp_path / "out.cpp"), str(input_file)])
+    assert "fstr::encode(fstr_out_, inner);" in (tmp_path / "out.cpp").read_text()
+    decoder = Decoder(json.loads(schema_file.read_text()))
+
+    inner = struct.pack("<I", perfect_hash("Inner", 0)) + b"h" + struct.pack("<h", -3)
+    data = struct.pack("<I", perfect_hash("Outer", 0))
+    data += b"?\x01" + b"d" + struct.pack("<d", 0.5) + b"P" + struct.pack("<Q", 255)
+    data += b"e" + b"i" + struct.pack("<i", 5) + b"r" + inner
+    texts = decoder.decode_all(data + inner)
+    assert texts == [
+        "Outer: bool flag=true, double d=0.5, const char * name=0xff, ns::Color c=green, Inner inner=Inner: short k=-3",
+        "Inner: short k=-3",
+    ]
+
+
+def test_encode_round_trip(tmp_path, build_and_run):
+    """
+    bytes written by a compiled encode() decode to what its to_string() prints, even with a field named out
+    """
+    input_file = tmp_path / "encode.cpp"
+    input_file.write_text(
+        """
+#include <fmt/format.h>
+#include <cstdio>
+#include <string>
+#include "fstr.h"
+struct Sample {
+  int out = 7;
+  double scale = 0.25;
+};
+int main() {
+  Sample sample;
+  std::string buffer;
+  sample.encode(buffer);
+  fmt::print("{}\\n", sample.to_string());
+  std::fwrite(buffer.data(), 1, buffer.size(), stdout);
+}
+"""
+    )
+    schema_file = tmp_path / "schema.json"
+    output_file = tmp_path / "out.cpp"
+    assert main(["--binary-schema", str(schema_file), "-o", str(output_file), str(input_file)]) == 0
+    text, data = build_and_run(output_file).split(b"\n", 1)
+    decoder = Decoder(json.loads(schema_file.read_text()))
+    assert decoder.decode_all(data) == [text.decode()]
+    assert "int out=7" in text.decode()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import json
 import os
 import subprocess
 import sys
@@ -6,9 +7,11 @@ from glob import glob
 from pathlib import Path
 from unittest.mock import patch
 
-import pytest  # noqa: F401
+import pytest
 
-from cpp_fstring.cpp_fstring import run
+from cpp_fstring.cpp_fstring import main, parse_args, run
+from cpp_fstring.DataClass import EnumConstantDecl, EnumRecord
+from cpp_fstring.Processor import Processor
 
 # cd to test dir to find testcase files
 abspath = os.path.abspath(__file__)
@@ -33,11 +36,6 @@ def filter_lines(input):
         line = line.strip()
         if line.isspace():
             continue
-        # TODO: fix false error due to ordering of namespace
-        if line.startswith("namespace Xnamespace {using ::format_as;}") or line.startswith(
-            "namespace roman {using ::format_as;}"
-        ):
-            continue
         if line == "":
             continue
         output.append(line)
@@ -81,3 +79,571 @@ def test_compare(capsys):
             print(f"{input_file=} {actual_output=} {expect_output=}")
         run_routine(capsys, input_file, actual_output)
         compare_output(capsys, actual_output, expect_output)
+
+
+def test_check(tmp_path):
+    """
+    --check passes right after generating output and fails once output is edited
+    """
+    input_file = f"{input_dir}/class_basic.cpp"
+    output_file = str(tmp_path / "class_basic.cpp")
+    assert main([input_file, "-o", output_file]) == 0
+    assert main(["--check", input_file, "-o", output_file]) == 0
+
+    with open(output_file, "a") as f:
+        f.write("// edited\n")
+    assert main(["--check", input_file, "-o", output_file]) == 1
+
+
+@pytest.mark.parametrize("executor", [[], ["--threads"]])
+def test_batch_pipeline(tmp_path, executor):
+    """
+    parallel batch output matches single file runs, and --check agrees with it
+    """
+    names = ["class_basic.cpp", "enum_basic.cpp", "class_iter.cpp"]
+    inputs = [f"{input_dir}/{name}" for name in names]
+    assert main(executor + ["-j", "2", "--output-dir", str(tmp_path / "out")] + inputs) == 0
+    for name, input_file in zip(names, inputs):
+        expect_file = str(tmp_path / name)
+        assert main([input_file, "-o", expect_file]) == 0
+        with open(expect_file, "rb") as f1, open(tmp_path / "out" / name, "rb") as f2:
+            assert f1.read() == f2.read()
+    assert main(executor + ["-j", "2", "--check", "--output-dir", str(tmp_path / "out")] + inputs) == 0
+
+    (tmp_path / "out" / names[0]).unlink()
+    assert main(executor + ["-j", "2", "--check", "--output-dir", str(tmp_path / "out")] + inputs) == 1
+
+
+def test_changed(tmp_path, capsys):
+    """
+    --changed only picks inputs that include the changed header
+    """
+    inputs = [f"{input_dir}/class_include.cpp", f"{input_dir}/enum_include.cpp", f"{input_dir}/class_basic.cpp"]
+    cache_dir = str(tmp_path / "cache")
+    assert main(["--cache-dir", cache_dir, "--output-dir", str(tmp_path / "out")] + inputs) == 0
+    capsys.readouterr()
+
+    assert main(["--cache-dir", cache_dir, "--changed", f"{input_dir}/enum_include.h", "--list-affected"] + inputs) == 0
+    assert capsys.readouterr().out.split() == [inputs[1]]
+    assert main(["--cache-dir", cache_dir, "--changed", inputs[2], "--list-affected"] + inputs) == 0
+    assert capsys.readouterr().out.split() == [inputs[2]]
+
+
+def test_edit_headers(tmp_path):
+    """
+    one parse of the .cpp rewrites an allow-listed header like processing the header by itself
+    """
+    inputs = [f"{input_dir}/class_include.cpp", f"{input_dir}/enum_include.cpp"]
+    assert main(["--edit-headers", "*_include.h", "--output-dir", str(tmp_path)] + inputs) == 0
+    for name in ["class_include.h", "enum_include.h", "class_include.cpp"]:
+        with open(tmp_path / name, "rb") as f1, open(f"{expect_dir}/{name}", "rb") as f2:
+            assert f1.read() == f2.read()
+
+
+def test_edit_headers_shared(tmp_path):
+    """
+    a header included by two files of a run is only extracted by the first of them
+    """
+    (tmp_path / "shared.h").write_text("struct Shared {\n  int a = 1;\n};\n")
+    inputs = []
+    for name in ["one", "two"]:
+        (tmp_path / f"{name}.cpp").write_text('#include "shared.h"\nint main() { return Shared{}.a; }\n')
+        inputs.append(str(tmp_path / f"{name}.cpp"))
+    jsonl = str(tmp_path / "run.jsonl")
+    args = ["-j", "1", "--edit-headers", "*shared.h", "--metrics-json", jsonl, "--output-dir", str(tmp_path / "out")]
+    assert main(args + inputs) == 0
+    with open(jsonl) as f:
+        assert json.loads(f.readline())["duplicates_avoided"] == 1
+    assert "to_string" in (tmp_path / "out" / "shared.h").read_text()
+
+
+def test_edit_headers_check(tmp_path):
+    """
+    --check with --edit-headers goes stale once a header output is edited
+    """
+    inputs = [f"{input_dir}/class_include.cpp", f"{input_dir}/enum_include.cpp"]
+    args = ["--edit-headers", "*_include.h", "--output-dir", str(tmp_path)]
+    assert main(args + inputs) == 0
+    for jobs in ["1", "2"]:
+        assert main(["-j", jobs, "--check"] + args + inputs) == 0
+
+    with open(tmp_path / "enum_include.h", "a") as f:
+        f.write("// edited\n")
+    for jobs in ["1", "2"]:
+        assert main(["-j", jobs, "--check"] + args + inputs) == 1
+
+
+def test_edit_headers_workers(tmp_path):
+    """
+    a header rendered by several workers is only written once
+    """
+    from cpp_fstring.Batch import Batch
+
+    (tmp_path / "shared.h").write_text("struct Shared {\n  int a = 1;\n};\n")
+    inputs = []
+    for name in ["one", "two", "three", "four"]:
+        (tmp_path / f"{name}.cpp").write_text('#include "shared.h"\nint main() { return Shared{}.a; }\n')
+        inputs.append(str(tmp_path / f"{name}.cpp"))
+    args, extraargs = parse_args(
+        ["-j", "2", "--edit-headers", "*shared.h", "--output-dir", str(tmp_path / "out")] + inputs
+    )
+    batch = Batch(args, extraargs)
+    assert batch.run(inputs) == []
+    assert batch.stats["headers"] == 1
+    assert "to_string" in (tmp_path / "out" / "shared.h").read_text()
+
+
+def write_structs(path, count):
+    """
+    input of count small structs, large enough that parsing it takes a while
+    """
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(f'struct S{i} {{\n  int a = {i};\n  const char* name = "s{i}";\n}};\n')
+    return str(path)
+
+
+def test_budget(capsys):
+    """
+    files within budget are processed as usual
+    """
+    input_file = f"{input_dir}/class_basic.cpp"
+    main([input_file])
+    expect = capsys.readouterr().out
+    main(["--time-budget", "60", input_file])
+    assert capsys.readouterr().out == expect
+    main(["--memory-budget", "200", input_file])
+    assert capsys.readouterr().out == expect
+
+
+@pytest.mark.parametrize("budget", [["--time-budget", "0.01"], ["--memory-budget", "25"]])
+def test_over_budget(tmp_path, capsys, budget):
+    """
+    files over their budget fall back, the memory budget only counting what the parse adds
+    """
+    input_file = write_structs(tmp_path / "structs.cpp", 5000)
+    main(["--literals-only", input_file])
+    expect = capsys.readouterr().out
+    main(budget + [input_file])
+    assert capsys.readouterr().out == expect
+
+    main(budget + ["--over-budget", "passthrough", input_file])
+    with open(input_file) as f:
+        assert capsys.readouterr().out == f.read() + "\n\n\n"
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_over_budget_files(tmp_path, caplog, jobs):
+    """
+    the files that fell back are listed at the end of a batch run
+    """
+    inputs = [f"{input_dir}/class_basic.cpp", write_structs(tmp_path / "structs.cpp", 5000)]
+    main(["-j", jobs, "--time-budget", "0.5", "--output-dir", str(tmp_path / "out")] + inputs)
+    assert f"1 files over budget, fell back to literals: {inputs[1]}\n" in caplog.text
+
+
+def test_budget_threads(tmp_path):
+    """
+    with --threads budget children aren't forked, their startup doesn't count against the budget,
+    and symbols they see get back to the parent
+    """
+    from cpp_fstring.Batch import Batch
+    from cpp_fstring.SymbolTable import symbols
+
+    (tmp_path / "shared.h").write_text("struct Shared {\n  int a = 1;\n};\n")
+    inputs = []
+    for name in ["one", "two"]:
+        (tmp_path / f"{name}.cpp").write_text('#include "shared.h"\nint main() { return Shared{}.a; }\n')
+        inputs.append(str(tmp_path / f"{name}.cpp"))
+    args = ["--threads", "-j", "2", "--time-budget", "0.2", "--memory-budget", "200"]
+    args += ["--edit-headers", "*shared.h", "--output-dir", str(tmp_path / "out")]
+    batch = Batch(*parse_args(args + inputs))
+    assert batch.run(inputs) == []
+    assert batch.stats["over_budget"] == 0
+    assert any(entry[0] == "Shared" for entry in symbols.get_state()[0].values())
+    assert "to_string" in (tmp_path / "out" / "shared.h").read_text()
+
+
+def test_metrics(tmp_path):
+    """
+    both metrics files describe the run
+    """
+    inputs = [f"{input_dir}/class_basic.cpp", f"{input_dir}/class_iter.cpp"]
+    prom, jsonl = str(tmp_path / "run.prom"), str(tmp_path / "run.jsonl")
+    args = ["--metrics-file", prom, "--metrics-json", jsonl, "--output-dir", str(tmp_path / "out")]
+    assert main(args + inputs) == 0
+    assert main(args + inputs) == 0
+
+    with open(jsonl) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 2
+    assert records[-1]["files"] == 2
+    assert records[-1]["parse_skipped"] == 1
+    assert records[-1]["latency_seconds"]["parse"]["count"] == 1
+    with open(prom) as f:
+        lines = f.read().splitlines()
+    assert "cpp_fstring_last_run_files 2" in lines
+    assert 'cpp_fstring_last_run_phase_seconds_count{phase="generate"} 2' in lines
+
+
+def test_size_report(tmp_path):
+    """
+    every enum gets a format_as, and totals add up
+    """
+    report = str(tmp_path / "size.json")
+    output = str(tmp_path / "enum_namespace.cpp")
+    assert main(["--size-report", report, "-o", output, f"{input_dir}/enum_namespace.cpp"]) == 0
+    with open(report) as f:
+        record = json.load(f)
+    artifacts = record["artifacts"]
+    assert {item["kind"] for item in artifacts} == {"format_as"}
+    assert "roman::sym" in [item["record"] for item in artifacts]
+    assert not any(item["in_header"] for item in artifacts)
+    assert record["namespaces"]["roman"]["artifacts"] == 1
+    total = sum(item["bytes"] for item in artifacts)
+    assert sum(item["bytes"] for item in record["files"].values()) == total
+
+
+@pytest.mark.parametrize(
+    "indexes, expect",
+    [
+        (["0", "1", "3"], 'static constexpr const char* names[] = {\n    "a",          // 0'),
+        (["-100", "1", "100000"], '{-100, "a"},\n    {1, "b"},\n    {100000, "c"},'),
+        (["0", "0", "0"], "switch (obj)"),
+        (["0", "1", "18446744073709551615"], '{1, "b"},\n    {18446744073709551615ull, "c"},'),
+        (["-9223372036854775808", "0", "1"], '{(-9223372036854775807ll - 1), "a"},'),
+    ],
+)
+def test_enum_table(indexes, expect):
+    """
+    dense values index an array, sparse ones are searched, unknown ones stay a switch
+    """
+    args, _ = parse_args(["--enum-format", "table", "dummy.cpp"])
+    rec = EnumRecord("ns::E", is_scoped=True)
+    rec.values = [EnumConstantDecl(name, index) for name, index in zip("abc", indexes)]
+    assert expect in Processor(args).gen_one_enum(rec)
+
+
+def test_enum_table_output(tmp_path, build_and_run):
+    """
+    64 bit values build without warnings and print their names
+    """
+    input_file = tmp_path / "enum64.cpp"
+    input_file.write_text(
+        """
+#include <fmt/format.h>
+#include "fstr.h"
+enum class Mask : unsigned long long { none = 0, low = 1, all = 18446744073709551615u };
+enum class Offset : long long { min = -9223372036854775807 - 1, zero = 0, max = 9223372036854775807 };
+// generated functions are appended, so they are only found when show is instantiated
+template <typename E>
+void show(const char* name) {
+  E obj{};
+  from_string(name, obj);
+  fmt::print("{} ", format_as(obj));
+}
+int main() {
+  show<Mask>("all");
+  show<Offset>("min");
+  show<Offset>("max");
+}
+"""
+    )
+    output_file = tmp_path / "enum64_out.cpp"
+    assert main(["--enum-format", "table", "--enum-from-string", str(input_file), "-o", str(output_file)]) == 0
+    assert build_and_run(output_file).decode() == "all min max "
+
+
+def test_enum_from_string():
+    """
+    from_string uses the same qualified names as format_as
+    """
+    args, _ = parse_args(["--enum-from-string", "dummy.cpp"])
+    rec = EnumRecord("ns::E", namespace="ns")
+    rec.values = [EnumConstantDecl(name, str(index)) for index, name in enumerate(["a", "b", "c"])]
+    out = Processor(args).gen_enum_format([rec])
+    assert "inline bool from_string(fmt::string_view name, ns::E& obj) {" in out
+    assert "ns::a" in out and "ns::E::a" not in out
+    assert "namespace ns {using ::format_as; using ::from_string;}" in out
+
+
+@pytest.mark.parametrize("style, expect", [("checked", "FMT_STRING("), ("compiled", "FMT_COMPILE(")])
+def test_to_string_style(capsys, style, expect):
+    """
+    compile-time format strings keep the arg types, wrapped in safe_arg
+    """
+    main(["--to-string-style", style, f"{input_dir}/class_basic.cpp"])
+    out = capsys.readouterr().out
+    assert (
+        f'return fmt::format({expect}"Foo: int a={{}}, int[10] b={{}}"), fstr::safe_arg(a), fstr::safe_arg(b));' in out
+    )
+    assert "fmt_string" not in out
+
+
+def test_format_to(capsys):
+    """
+    to_string is a wrapper around the generated format_to
+    """
+    main(["--format-to", f"{input_dir}/class_basic.cpp"])
+    out = capsys.readouterr().out
+    assert "  OutputIt format_to(OutputIt fstr_out_) const {\n" in out
+    assert (
+        'fmt::format_to(fstr_out_, fmt::runtime("Foo: int a={}, int[10] b={}"), fstr::safe_arg(a), fstr::safe_arg(b));'
+        in out
+    )
+    assert out.count("format_to(std::back_inserter(fstr_out_));") == out.count("auto to_string() const {")
+
+
+def test_format_to_output(tmp_path, build_and_run):
+    """
+    a field named out still prints its value
+    """
+    input_file = tmp_path / "format_to.cpp"
+    input_file.write_text(
+        """
+#include <fmt/format.h>
+#include "fstr.h"
+struct Sample {
+  int out = 7;
+};
+int main() {
+  fmt::memory_buffer buffer;
+  Sample().format_to(fmt::appender(buffer));
+  fmt::print("{} {}\\n", fmt::to_string(buffer), Sample().to_string());
+}
+"""
+    )
+    output_file = tmp_path / "format_to_out.cpp"
+    assert main(["--format-to", str(input_file), "-o", str(output_file)]) == 0
+    assert build_and_run(output_file).decode() == "Sample: int out=7 Sample: int out=7\n"
+
+
+@pytest.mark.parametrize(
+    "f_str, expect",
+    [
+        ('"{:>8.2f} {{lit}}"', 'FMT_COMPILE("{:>8.2f} {{lit}}")'),
+        ('R"(raw {})"', 'FMT_COMPILE(R"(raw {})")'),
+        ('L"wide {}"', 'L"wide {}"'),
+        ('"udl {}"_s', '"udl {}"_s'),
+        ('"{:{}}"', '"{:{}}"'),
+    ],
+)
+def test_fstring_style(f_str, expect):
+    """
+    literals that FMT_COMPILE can't take stay runtime format strings
+    """
+    args, _ = parse_args(["--fstring-style", "compiled", "dummy.cpp"])
+    assert Processor(args).get_fstring_format(f_str) == expect
+
+
+def test_hash_seed():
+    """
+    output bytes don't change with PYTHONHASHSEED
+    """
+    input_file = f"{input_dir}/enum_namespace.cpp"
+    outputs = set()
+    for seed in ["0", "1", "2", "3"]:
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        cmd = [sys.executable, "-m", "cpp_fstring.cpp_fstring", input_file]
+        outputs.add(subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True).stdout)
+    assert len(outputs) == 1
+
+
+def test_emit_edits(capsys):
+    """
+    applying the json edit records to the input reproduces the full output
+    """
+    input_file = f"{input_dir}/class_basic.cpp"
+    main([input_file])
+    expect = capsys.readouterr().out.encode("utf8")
+    main(["--emit", "json", input_file])
+    edits = json.loads(capsys.readouterr().out)["edits"]
+
+    with open(input_file, "rb") as f:
+        actual = bytearray(f.read())
+    for edit in reversed(edits):
+        actual[edit["offset"] : edit["offset"] + edit["length"]] = edit["replacement"].encode("utf8")
+    assert bytes(actual) == expect
+
+
+def test_non_ascii(tmp_path, capsys):
+    """
+    non-ascii text before a literal must not shift later edits
+    """
+    input_file = tmp_path / "non_ascii.cpp"
+    input_file.write_bytes('// héllo ✓\nint main() {\n  int x = 1;\n  auto s = "é {x} ü";\n}\n'.encode("utf8"))
+    main([str(input_file)])
+    assert 'auto s = fmt::format("é {} ü", x);' in capsys.readouterr().out
+
+
+def test_print_to_stream(tmp_path, capsys):
+    """
+    literals streamed into an ostream are printed into it, other << targets keep fmt::format
+    """
+    input_file = tmp_path / "stream.cpp"
+    input_file.write_text(
+        """
+namespace std {
+template <typename C> struct basic_ostream {};
+template <typename C> struct basic_ostringstream : basic_ostream<C> {};
+using ostream = basic_ostream<char>;
+using ostringstream = basic_ostringstream<char>;
+}
+struct Logger {};
+Logger& operator<<(Logger& log, const char* s);
+void f(std::ostream& os, std::ostringstream& ss, Logger& log, int x) {
+  os << "os {x}";
+  if (x) ss << "ss {x}" << x;
+  log << "log {x}";
+}
+"""
+    )
+    main(["--print-to-stream", str(input_file)])
+    actual = capsys.readouterr().out
+    assert 'fmt::print(os, "os {}", x);' in actual
+    assert 'if (x) fmt::print(ss, "ss {}", x), ss << x;' in actual
+    assert 'log << fmt::format("log {}", x);' in actual
+
+
+def test_log_call(tmp_path, capsys):
+    """
+    literals passed to logging calls are split into format string and args
+    """
+    input_file = tmp_path / "log.cpp"
+    input_file.write_text(
+        """
+namespace spdlog { void debug(const char* s, int x); }
+void LOG_DEBUG(const char* s, int x);
+void f(int x) {
+  LOG_DEBUG("macro {x}");
+  spdlog::debug("function {x}");
+  auto s = "other {x}";
+}
+"""
+    )
+    main(["--log-call", "LOG_DEBUG", "--log-call", "debug", str(input_file)])
+    actual = capsys.readouterr().out
+    assert 'LOG_DEBUG("macro {}", x);' in actual
+    assert 'spdlog::debug("function {}", x);' in actual
+    assert 'auto s = fmt::format("other {}", x);' in actual
+
+
+def test_max_elements(tmp_path, capsys):
+    """
+    range fields are bounded by --max-elements unless a --max-elements-for pattern matches them
+    """
+    input_file = tmp_path / "bounded.cpp"
+    input_file.write_text(
+        """
+#include <vector>
+struct Frame {
+  float pixels[1000];
+  int ids[8];
+  int small[2];
+  std::vector<int> values;
+  int count;
+};
+"""
+    )
+    main(
+        [
+            "--max-elements",
+            "16",
+            "--max-elements-for",
+            "ids=0",
+            "--max-elements-for",
+            "Frame::small=-1",
+            str(input_file),
+        ]
+    )
+    actual = capsys.readouterr().out
+    params = "fstr::bound(pixels, 16), fstr::bound(ids, 0), small, fstr::bound(values, 16), count"
+    assert f"fstr::format(fmt_string, {params});" in actual
+
+
+def test_max_elements_output(tmp_path, build_and_run):
+    """
+    bounded fields print their first elements and a count of the rest
+    """
+    input_file = tmp_path / "bounded.cpp"
+    input_file.write_text(
+        """
+#include <fmt/format.h>
+#include <vector>
+#include "fstr.h"
+struct Frame {
+  float pixels[6] = {0.5, 1.5, 2.5, 3.5, 4.5, 5.5};
+  std::vector<int> ids = {1, 2};
+  int count = 6;
+};
+int main() { fmt::print("{}\\n", Frame().to_string()); }
+"""
+    )
+    output_file = tmp_path / "bounded_out.cpp"
+    assert main(["--max-elements", "2", str(input_file), "-o", str(output_file)]) == 0
+    output = build_and_run(output_file).decode()
+    assert "pixels=[0.5, 1.5, ...(4 more)]" in output
+    assert "ids=[1, 2]" in output
+    assert "count=6" in output
+
+
+def test_inherited_fields_delegate(tmp_path, capsys):
+    """
+    derived classes print their bases with the base to_string instead of copying base fields
+    """
+    input_file = tmp_path / "derived.cpp"
+    input_file.write_text(
+        """
+template <typename T> struct Holder { T value; };
+class A { int a; };
+struct B : A { int b; };
+struct C : B, Holder<int> { int c; };
+"""
+    )
+    main(["--inherited-fields", "delegate", str(input_file)])
+    actual = capsys.readouterr().out
+    assert 'fmt_string = "C: {{{}}}, {{{}}}, int c={}";' in actual
+    assert (
+        "fstr::format(fmt_string, static_cast<const B&>(*this), static_cast<const Holder<int>&>(*this), c);" in actual
+    )
+    assert "this->a" not in actual and "friend" not in actual
+
+
+def test_inherited_fields_missing_base(tmp_path, capsys, caplog):
+    """
+    a template base left out of the parse by a missing std include is still delegated to,
+    and an undeclared base gets a warning
+    """
+    input_file = tmp_path / "derived.cpp"
+    input_file.write_text(
+        """
+#include <string>
+template <typename T> struct Holder { T value; };
+struct B { int b; };
+struct C : public B, Holder<std::string> { int c; };
+struct D : std::string { int d; };
+struct E : Undeclared { int e; };
+"""
+    )
+    main(["--inherited-fields", "delegate", str(input_file)])
+    actual = capsys.readouterr().out
+    params = "static_cast<const B&>(*this), static_cast<const Holder<std::string>&>(*this), c"
+    assert f"fstr::format(fmt_string, {params});" in actual
+    assert "base Undeclared of E isn't declared in the parse" in caplog.text
+    assert "std::string" not in caplog.text
+    caplog.clear()
+
+    main([str(input_file)])
+    capsys.readouterr()
+    assert "Holder" not in caplog.text
+
+
+@pytest.mark.parametrize("mode", ["flatten", "delegate"])
+def test_inherited_fields_no_false_warnings(capsys, caplog, mode):
+    """
+    template and std bases that flattening always left out aren't reported as missing
+    """
+    for name in ["class_crtp.cpp", "class_derived_template.cpp", "app_tinyply.cpp"]:
+        main(["--inherited-fields", mode, f"{input_dir}/{name}"])
+    capsys.readouterr()
+    assert "base" not in caplog.text
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import os
+from glob import glob
+
+import pytest
+
+from cpp_fstring.Lexer import Lexer
+
+input_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "input")
+
+
+def get_spellings(code):
+    return [rec.spelling for rec in Lexer().extract_string_records(code)]
+
+
+@pytest.mark.parametrize(
+    "code, expect",
+    [
+        (b'const char* g = "{x}";', []),
+        (b'void f() { auto s = "{x}"; }', ['"{x}"']),
+        (b'void f() { auto s = "x"; }', []),
+        (b'void f() const noexcept // {\n{ auto s = u8"{x}"; }', ['u8"{x}"']),
+        (b'auto f() -> int { return "{x}"[0]; }', ['"{x}"']),
+        (b'struct S { std::string m = "{x}"; void f() { g("{m}"); } };', ['"{m}"']),
+        (b'S::S() : m{"{x}"}, n(1) { g("{n}"); }', ['"{n}"']),
+        (b'struct S : B<decltype(f())> { int m = "{x}"[0]; };', []),
+        (b'auto l = [](int x) { return "{x}"; };', ['"{x}"']),
+        (b'auto l = [] { return "{x}"; };', ['"{x}"']),
+        (b'std::string a[] = {"{x}"};', []),
+        (b'extern "C" { int f() { return "{x}"[0]; } }', ['"{x}"']),
+        (b'void f() { auto s = R"x( )" {x} )x"; }', ['R"x( )" {x} )x"']),
+        (b'void f() { auto s = "\\" {x}"; int n = 1\'000; }', ['"\\" {x}"']),
+        (b'#define M() { "{x}" }\nvoid f() { auto s = "a \\\n {x}"; }', ['"a \\\n {x}"']),
+        (b"void f() { /* { */ char c = '{'; // }\n}", ["'{'"]),
+    ],
+)
+def test_extract_string_records(code, expect):
+    assert get_spellings(code) == expect
+
+
+@pytest.mark.parametrize("input_file", sorted(glob(f"{input_dir}/*")))
+def test_same_as_libclang(input_file):
+    """
+    lexer finds the same literals as the libclang parse
+    """
+    from cpp_fstring.ParseCPP import ParseCPP
+
+    with open(input_file, "rb") as f:
+        code = f.read()
+    string_records, _, _ = ParseCPP(code, input_file, []).extract_interesting_records()
+    expect = [[tok.extent.start.offset, tok.extent.end.offset] for tok in string_records]
+    actual = [[tok.extent.start.offset, tok.extent.end.offset] for tok in Lexer().extract_string_records(code)]
+    assert sorted(actual) == sorted(expect)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import pytest
+
+from cpp_fstring.PerfectHash import PerfectHash, perfect_hash
+
+
+@pytest.mark.parametrize(
+    "names",
+    [
+        ["a"],
+        ["a", "b", "d"],
+        ["neg", "one", "big", "alias"],
+        ["RED", "Red", "red", "rEd"],
+        [f"msg_{i}" for i in range(5000)],
+        ["ünïcode", "unicode"],
+    ],
+)
+def test_perfect_hash(names):
+    table = PerfectHash(names)
+    assert sorted(table.slots) == sorted(names)
+    for name in names:
+        assert table.slots[table.get_slot(name)] == name
+
+
+def test_hash_value():
+    """
+    fstr::perfect_hash in fstr.h has to give the same values
+    """
+    assert perfect_hash("", 0) == 0xAB3E7C0B
+    assert perfect_hash("red", 3) == 0x0E4107F3
+    assert perfect_hash("red", 0) != perfect_hash("red", 1)
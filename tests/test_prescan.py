@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import pytest
+
+from cpp_fstring.Prescan import Prescan
+
+
+@pytest.mark.parametrize(
+    "code, expect",
+    [
+        (b"int main() { return 0; }", False),
+        (b"// enum class\nint x;", False),
+        (b"/* struct */ int x;", False),
+        (b"// line \\\n continued enum\nint x;", False),
+        (b'const char* s = "a { b";', True),
+        (b'const char* s = "a \\" { b";', True),
+        (b'auto s = u8"{x}";', True),
+        (b'char c = \'"\'; int x; // "{"', False),
+        (b'auto s = R"x(")" { )x";', True),
+        (b'auto s = R"x(")" struct )x";', False),
+        (b'auto s = LR"(struct)";', False),
+        (b'auto s = fooR"(x)"; "{"', True),
+        (b"int n = 1'000'000; const char* s = \"x\";", False),
+        (b"int n = 0x1'ff; // ' enum", False),
+        (b"int classic = 1;", False),
+        (b"struct A {};", True),
+        (b"enum E : int;", True),
+    ],
+)
+def test_needs_parse(code, expect):
+    assert Prescan().needs_parse(code) == expect